@@ -1,14 +1,27 @@
 import streamlit as st
-import yfinance as yf
-from streamlit_autorefresh import st_autorefresh
 import datetime 
-import pandas as pd 
 import database as db
-from function import add_transactions, get_holdings, calculate_port, add_withdrawal, port_history
+import perf
+
+# pandas, market data and analytics are imported inside main_page: the login
+# and register pages never need them (see bench.py --startup).
 
 st.set_page_config(page_title="My Portfolio", layout="wide")
 
-db.init_db()
+@st.cache_resource(show_spinner=False)
+def init_app(db_name):
+    db.init_db()
+
+def held_symbols():
+    import price_store
+    return db.get_held_symbols_db(price_store.split_factors(db.get_all_symbols_db()[0]))
+
+@st.cache_resource(show_spinner=False)
+def start_background():
+    import quotes
+    return quotes.start_refresher(held_symbols)
+
+init_app(db.DB_NAME)
 
 # --- Callback Functions ---
 def delete_tx_callback(t_id):
@@ -25,19 +38,75 @@ def delete_wd_callback(w_id):
     except Exception as e:
         st.error(f"Error: {e}")
 
-@st.cache_data(ttl=120)
 def fetch_current_prices(symbols):
-    prices = {}
-    if not symbols: return prices
-
-    for symbol in symbols:
-        try:
-            ticker = yf.Ticker(symbol)
-            data = ticker.fast_info
-            prices[symbol] = data["last_price"]
-        except:
-            prices[symbol] = 0.0
-    return prices
+    if not symbols: return {}
+    import quotes
+    import price_store
+    return quotes.read_prices(symbols, fallback=price_store.last_closes)
+
+CHART_RANGES = {"1M": 31, "6M": 183, "YTD": None, "1Y": 365, "5Y": 1826, "Max": None}
+
+def range_start(label):
+    today = datetime.date.today()
+    if label == "YTD":
+        return today.replace(month=1, day=1).strftime("%Y-%m-%d")
+    days = CHART_RANGES.get(label)
+    return (today - datetime.timedelta(days=days)).strftime("%Y-%m-%d") if days else None
+
+CHART_COLORS = ["#FF0000", "#00FF00", "#1F77B4", "#FF7F0E", "#9467BD", "#8C564B", "#E377C2", "#17BECF"]
+
+def add_custom_benchmark(user_id, benchmarks):
+    from benchmarks import parse_benchmark
+    spec = st.session_state.custom_benchmark.replace(" ", "").upper()
+    st.session_state.custom_benchmark = ""
+    if not spec:
+        st.session_state.benchmark_error = "Enter a ticker or mix to add"
+        return
+    if spec in benchmarks: return
+    try:
+        parse_benchmark(spec)
+    except ValueError as e:
+        st.session_state.benchmark_error = str(e)
+        return
+    db.set_benchmarks_db(user_id, benchmarks + [spec])
+
+def history_pager(key, filters):
+    # Keyset pagination state: the id each visited page starts below. 'gen'
+    # changes on every move so the table's row selection does not carry over.
+    pager = st.session_state.get(key)
+    if pager is None or pager["filters"] != filters:
+        gen = pager["gen"] + 1 if pager else 0
+        pager = st.session_state[key] = {"filters": filters, "cursors": [None], "gen": gen}
+    return pager
+
+def _page_older(pager, before_id):
+    pager["cursors"].append(before_id)
+    pager["gen"] += 1
+
+def _page_newer(pager):
+    pager["cursors"].pop()
+    pager["gen"] += 1
+
+def page_controls(key, pager, rows, total):
+    page = len(pager["cursors"])
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    col_prev.button("◀ Newer", key=f"{key}_newer", disabled=page == 1,
+                    on_click=_page_newer, args=(pager,))
+    col_info.caption(f"Page {page} of {max(1, -(-total // db.PAGE_SIZE))} · {total:,} rows")
+    col_next.button("Older ▶", key=f"{key}_older", disabled=len(rows) <= db.PAGE_SIZE,
+                    on_click=_page_older, args=(pager, rows[db.PAGE_SIZE - 1]["id"] if len(rows) > db.PAGE_SIZE else None))
+
+def performance_panel(recorder):
+    with st.sidebar.expander("Performance", expanded=True):
+        st.caption(f"Render: {recorder.total * 1000:,.1f} ms")
+        st.dataframe([{"Stage": name, "ms": round(t * 1000, 1), "Calls": n}
+                      for name, (t, n) in recorder.stages.items()],
+                     use_container_width=True, hide_index=True)
+        for name, rate in recorder.hit_rates().items():
+            st.caption(f"{name} cache hit rate: {rate:.0%}")
+        others = {k: v for k, v in recorder.counters.items() if not k.endswith((".lookups", ".misses"))}
+        if others:
+            st.caption(", ".join(f"{k}: {v:,}" for k, v in others.items()))
 
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
@@ -105,13 +174,47 @@ def login_page():
                 st.rerun()
 
 def main_page():
+    import pandas as pd
+    import fx
+    import quotes
+    import price_store
+    from streamlit_autorefresh import st_autorefresh
+    from importer import parse_csv, validate_import
+    from function import summary_in_base, total_in_base, latest_rates
+    from tx_columns import split_multiplier
+    from nav import cached_history, cached_risk
+    from benchmarks import PRESETS, benchmark_label
+    start_background()
+
     st_autorefresh(interval=120000, key="price_refresher")
     st.title("My Portfolio")
 
     current_user_id = st.session_state.user_id
-
-    transactions = db.get_tx_db(current_user_id)
-    withdrawals = db.get_wd_db(current_user_id)
+    perf.start(perf.ENABLED or st.session_state.get("perf_panel", False))
+
+    with perf.stage("db.counts"):
+        tx_count = db.count_tx_db(current_user_id)
+        base = db.get_base_currency_db(current_user_id)
+        ledger_version = db.get_ledger_version_db(current_user_id)
+    perf.count("rows.transactions", tx_count)
+
+    # Normally filled in by worker.py; computed here only when it is stale.
+    # Positions are read in today's shares throughout. Without FX rates for
+    # one of the user's currencies nothing is converted or cached, and only
+    # the sidebar is shown.
+    rates_error = None
+    with perf.stage("summary"):
+        splits = price_store.split_factors(db.get_tx_symbols_db(current_user_id))
+        splits_key = price_store.splits_signature(splits)
+        summary = db.get_summary_db(current_user_id, ledger_version, splits_key)
+        perf.lookup("summary", misses=int(summary is None))
+        try:
+            total_withdrawn = total_in_base(db.get_wd_flows_db(current_user_id), base)
+            if summary is None:
+                summary = summary_in_base(db.get_tx_columns(current_user_id), base, splits)
+                db.save_summary_db(current_user_id, ledger_version, *summary, splits_key=splits_key)
+        except fx.RatesUnavailable as e:
+            rates_error = e
 
     # --- Sidebar ---
     st.sidebar.title(f'User {st.session_state.username}')
@@ -119,14 +222,24 @@ def main_page():
         st.session_state.logged_in = False
         st.session_state.user_id = None
         st.rerun()
+    currencies = list(fx.CURRENCIES)
+    new_base = st.sidebar.selectbox("Base currency", currencies, index=currencies.index(base), key="base_currency")
+    if new_base != base:
+        db.set_base_currency_db(current_user_id, new_base)
+        st.rerun()
     st.sidebar.header("Add Transactions")
 
-    mode = st.sidebar.radio("Mode", ["Trade [BUY/SELL]", "Withdraw Fund"])
+    mode = st.sidebar.radio("Mode", ["Trade [BUY/SELL]", "Withdraw Fund", "Import CSV"])
 
     if mode == "Trade [BUY/SELL]":
         tx_type = st.sidebar.selectbox("Action", ["BUY","SELL"])
         tx_date = st.sidebar.date_input("Transaction Date", value=datetime.date.today())
         symbol = st.sidebar.text_input("Symbol (e.g. NVDA)").upper()
+        # An open position stays in the currency it was bought in.
+        held_in = db.get_position_currency_db(current_user_id, symbol, splits) if symbol else None
+        quote_currency = held_in or fx.symbol_currency(symbol)
+        tx_currency = st.sidebar.selectbox("Currency", currencies, index=currencies.index(quote_currency),
+                                           key=f"tx_currency_{quote_currency}")
         qty = st.sidebar.number_input("Quantity", min_value=0.0000001, format="%.7f")
         price = st.sidebar.number_input("Price per Share", min_value=0.0)
         com = st.sidebar.number_input("Commission", min_value=0.0)
@@ -135,46 +248,80 @@ def main_page():
         if submit:
             if not symbol or qty <= 0 or price <= 0:
                 st.sidebar.error("Invalid input")
+            elif held_in and tx_currency != held_in:
+                st.sidebar.error(f"{symbol} is held in {held_in}")
             else:
                 if tx_type == "SELL":
-                    holdings = get_holdings(transactions)
-                    current_qty = holdings.get(symbol, {}).get("qty", 0)
-                    if qty > current_qty:
+                    current_qty = db.get_position_qty_db(current_user_id, symbol, splits)
+                    if symbol in splits:
+                        qty_now = qty * float(split_multiplier(db.to_day(tx_date), *splits[symbol]))
+                    else:
+                        qty_now = qty
+                    if qty_now > current_qty:
                         st.sidebar.error("Not enough shares!")
                         st.stop()
 
-                db.add_tx_db(current_user_id, tx_type, symbol, qty, price, com, date=tx_date.strftime("%Y-%m-%d"))
+                db.add_tx_db(current_user_id, tx_type, symbol, qty, price, com, date=tx_date.strftime("%Y-%m-%d"),
+                             currency=tx_currency, splits=splits)
                 st.success(f"Recorded {tx_type} {symbol} on {tx_date}")
                 st.rerun()
 
     elif mode == "Withdraw Fund":
         st.sidebar.info("Pull money back from Cash Cow")
         wd_date = st.sidebar.date_input("Withdrawal Date", value=datetime.date.today())
-        amount = st.sidebar.number_input("Amount (USD)", min_value=0.0)
+        amount = st.sidebar.number_input(f"Amount ({base})", min_value=0.0)
 
         if st.sidebar.button("Confirm Withdraw"):
-            rev, _, _ = calculate_port(transactions)
-            current_withdrawn = sum(w["amount"] for w in withdrawals)
-            available_cash = rev - current_withdrawn
+            if rates_error:
+                st.sidebar.error(str(rates_error))
+                st.stop()
+            rev = summary[0]
+            available_cash = rev - total_withdrawn
 
             if amount > available_cash:
-                st.sidebar.error(f"Insufficient Cash! Available: ${available_cash:,.2f}")
+                st.sidebar.error(f"Insufficient Cash! Available: {fx.money(available_cash, base)}")
             elif amount <= 0:
                 st.sidebar.error("Amount must be > 0")
             else:
-                db.add_wd_db(current_user_id, amount, date=wd_date.strftime("%Y-%m-%d"))
-                st.sidebar.success(f"Withdrew ${amount:,.2f} on {wd_date}")
+                db.add_wd_db(current_user_id, amount, date=wd_date.strftime("%Y-%m-%d"), currency=base)
+                st.sidebar.success(f"Withdrew {fx.money(amount, base)} on {wd_date}")
                 st.rerun()
 
+    elif mode == "Import CSV":
+        st.sidebar.info("Columns: date, action (BUY/SELL), symbol, quantity, price, commission, currency (optional)")
+        uploaded = st.sidebar.file_uploader("Broker statement", type=["csv"])
+
+        if uploaded is not None and st.sidebar.button("Import Trades"):
+            try:
+                rows = parse_csv(uploaded)
+            except Exception as e:
+                st.sidebar.error(f"Cannot read file: {e}")
+                st.stop()
+
+            import_symbols = {r["symbol"] for r in rows if r["symbol"]}
+            price_store.refresh_actions(import_symbols)
+            import_splits = price_store.split_factors(set(db.get_tx_symbols_db(current_user_id)) | import_symbols)
+            errors = validate_import(db.get_tx_columns(current_user_id), rows, import_splits)
+            if errors:
+                st.sidebar.error(f"{len(errors)} row(s) rejected, nothing imported")
+                st.sidebar.caption("\n\n".join(errors[:20]))
+            elif not rows:
+                st.sidebar.warning("No trades found in file")
+            else:
+                db.add_tx_many_db(current_user_id, rows)
+                st.sidebar.success(f"Imported {len(rows)} trades")
+                st.rerun()
+
+    if rates_error:
+        st.warning(f"{rates_error}; values in {base} will show once they can be fetched.")
+        st.stop()
+
     # --- Calculation Zone ---
-    total_sell_revenue, total_invested, realized_pnl = calculate_port(transactions)
-    total_withdrawn = sum(w["amount"] for w in withdrawals)
+    total_sell_revenue, total_invested, realized_pnl = summary
     cash_cow = total_sell_revenue - total_withdrawn
 
-    holdings = get_holdings(transactions)
-
-    if "current_prices" not in st.session_state:
-        st.session_state.current_prices = {}
+    with perf.stage("db.holdings"):
+        holdings = db.get_holdings_db(current_user_id, splits)
 
     table = []
     total_unrelized = 0.0
@@ -187,19 +334,28 @@ def main_page():
         roi_relized = 0.0
 
     active_symbols = list(holdings.keys())
-    current_prices = fetch_current_prices(active_symbols)
-
-    if active_symbols:
-        if not st.session_state.current_prices: 
-            st.session_state.current_prices = current_prices
+    with perf.stage("quotes"):
+        current_prices = fetch_current_prices(active_symbols)
+
+    # Positions are kept in their trades' currency and quoted in the listing's;
+    # both are translated into the base currency at today's rate.
+    with perf.stage("fx"):
+        tx_currencies = db.get_tx_currencies_db(current_user_id)
+        quote_currencies = {s: fx.symbol_currency(s) for s in active_symbols}
+        try:
+            rates = latest_rates(set(quote_currencies.values()) | {tx_currencies.get(s, base) for s in active_symbols}, base)
+        except fx.RatesUnavailable as e:
+            st.warning(f"{e}; values in {base} will show once they can be fetched.")
+            st.stop()
 
     for symbol, data in holdings.items():
         qty = data["qty"]
         cost_basis_per_share = data["avg_cost"]
-        current_price = st.session_state.current_prices.get(symbol, 0.0)
+        current_price = current_prices.get(symbol, 0.0)
+        quote_currency = quote_currencies[symbol]
 
-        market_value =  qty * current_price
-        cost_basis_total = qty * cost_basis_per_share
+        market_value = qty * current_price * rates[quote_currency]
+        cost_basis_total = qty * cost_basis_per_share * rates[tx_currencies.get(symbol, quote_currency)]
         unrelized_pnl = market_value - cost_basis_total
 
         portfolio_value += market_value
@@ -207,11 +363,12 @@ def main_page():
 
         table.append({
             "Symbol": symbol,
+            "Currency": quote_currency,
             "Quantity": round(qty, 7),
             "Avg Cost": round(cost_basis_per_share, 4),
             "Current Price": current_price,
-            "Market Value": round(market_value, 2),
-            "Unrelized P&L": round(unrelized_pnl, 2)
+            f"Market Value ({base})": round(market_value, 2),
+            f"Unrelized P&L ({base})": round(unrelized_pnl, 2)
         })
 
     # --- Interface ---
@@ -219,28 +376,65 @@ def main_page():
 
     col1, col2, col3, col4 = st.columns(4)
 
-    col1.metric("Total Invested", f"${total_invested:,.2f}")
-    col2.metric("Portfolio Value", f"${portfolio_value:,.2f}")
-    col3.metric("Cash Cow (Available)", f"${cash_cow:,.2f}")
-    col4.metric("Realized P&L", f"${realized_pnl:,.2f} / {roi_relized:,.2f}%")
+    col1.metric("Total Invested", fx.money(total_invested, base))
+    col2.metric("Portfolio Value", fx.money(portfolio_value, base))
+    col3.metric("Cash Cow (Available)", fx.money(cash_cow, base))
+    col4.metric("Realized P&L", f"{fx.money(realized_pnl, base)} / {roi_relized:,.2f}%")
 
     # Chart Section
-    if transactions:
+    if tx_count:
+        chart_range = st.radio("Range", list(CHART_RANGES), index=len(CHART_RANGES) - 1,
+                               horizontal=True, key="chart_range", label_visibility="collapsed")
+        benchmarks = db.get_benchmarks_db(current_user_id)
+        col_bench, col_custom, col_add = st.columns([3, 2, 1], vertical_alignment="bottom")
+        chosen = col_bench.multiselect("Benchmarks", list(dict.fromkeys(list(PRESETS) + benchmarks)),
+                                       default=benchmarks, format_func=benchmark_label)
+        col_custom.text_input("Custom benchmark", placeholder="QQQ or SPY*0.6+AGG*0.4", key="custom_benchmark")
+        col_add.button("Add", on_click=add_custom_benchmark, args=(current_user_id, benchmarks))
+        if st.session_state.get("benchmark_error"):
+            st.error(st.session_state.pop("benchmark_error"))
+        if chosen != benchmarks:
+            db.set_benchmarks_db(current_user_id, chosen)
+            benchmarks = chosen
         try:
-            with st.spinner("Calculating historical performance..."):
-                df_chart = port_history(transactions)
+            with st.spinner("Calculating historical performance..."), perf.stage("history"):
+                perf.lookup("history_cache")
+                df_chart = cached_history(current_user_id, ledger_version, price_store.freshness_key(),
+                                          range_start(chart_range), benchmarks=tuple(benchmarks))
             
             if not df_chart.empty:
-                st.line_chart(df_chart, color=["#FF0000", "#00FF00"])
+                with perf.stage("render.chart"):
+                    colors = [CHART_COLORS[i % len(CHART_COLORS)] for i in range(len(df_chart.columns))]
+                    st.line_chart(df_chart, color=colors)
+        except fx.RatesUnavailable as e:
+            st.warning(f"{e}; the chart will show once they can be fetched.")
         except:
             st.info("Chart needs more data.")
 
+        with perf.stage("risk"):
+            try:
+                risk = cached_risk(current_user_id, ledger_version, price_store.freshness_key())
+            except fx.RatesUnavailable:
+                risk = {}
+        if risk:
+            fmt = lambda v: "n/a" if v is None else f"{v * 100:,.2f}%"
+            r1, r2, r3, r4, r5 = st.columns(5)
+            r1.metric("TWR", fmt(risk["twr"]))
+            r2.metric("XIRR (annual)", fmt(risk["xirr"]))
+            r3.metric("Volatility (annual)", fmt(risk["volatility"]))
+            r4.metric("Max Drawdown", fmt(-risk["max_drawdown"]))
+            r5.metric("Sharpe (3M)", "n/a" if risk["sharpe"] is None else f"{risk['sharpe']:.2f}")
+
     st.subheader("Current Holdings")
-    st.metric("Unrealized P&L", f"${total_unrelized:,.2f} / {roi_unrealized:,.2f}%", delta=f"{total_unrelized:,.2f}")
-    st.caption("Price auto-updates every 2 minutes")
+    st.metric("Unrealized P&L", f"{fx.money(total_unrelized, base)} / {roi_unrealized:,.2f}%", delta=f"{total_unrelized:,.2f}")
+    last_refresh = quotes.last_refresh()
+    if last_refresh:
+        st.caption(f"Prices as of {datetime.datetime.fromtimestamp(last_refresh):%H:%M:%S}, refreshed in the background")
+    else:
+        st.caption("Prices are being fetched in the background")
 
     if st.button("Refresh Price Now"):
-        st.session_state.current_prices = current_prices
+        quotes.refresh_now(active_symbols)
         st.rerun()
 
     st.divider()
@@ -250,27 +444,39 @@ def main_page():
     # --- History ---
     with col_main:
         st.subheader("📦 Current Holdings")
-        st.dataframe(table, use_container_width=True)
+        with perf.stage("render.holdings"):
+            st.dataframe(table, use_container_width=True)
 
         action_container = st.container()
 
         st.subheader("📜 Trade History (click for delete)")
-        if transactions:
-            df_tx = pd.DataFrame(transactions)
-            df_tx = df_tx.sort_values(by='id', ascending=False)
-            df_tx['No.'] = range(1, len(df_tx) + 1)
-            
-            cols = ['No.', 'id'] + [c for c in df_tx.columns if c not in ['No.', 'id']]
-            df_tx = df_tx[cols]
-
-            event_tx = st.dataframe(
-                df_tx,
-                use_container_width=True,
-                hide_index=True, 
-                on_select="rerun",
-                selection_mode="single-row",
-                key="history_table_v2"
-            )
+        if tx_count:
+            col_sym, col_from, col_to = st.columns([2, 1, 1])
+            symbol_filter = col_sym.selectbox("Symbol", ["All"] + db.get_tx_symbols_db(current_user_id), key="tx_symbol_filter")
+            date_from = col_from.date_input("From", value=None, key="tx_date_from")
+            date_to = col_to.date_input("To", value=None, key="tx_date_to")
+            filters = (None if symbol_filter == "All" else symbol_filter,
+                       date_from.strftime("%Y-%m-%d") if date_from else None,
+                       date_to.strftime("%Y-%m-%d") if date_to else None)
+
+            with perf.stage("render.trades"):
+                pager = history_pager("tx_pager", filters)
+                rows = db.get_tx_page_db(current_user_id, pager["cursors"][-1], db.PAGE_SIZE + 1, *filters)
+                total = db.count_tx_db(current_user_id, *filters)
+
+                df_tx = pd.DataFrame(rows[:db.PAGE_SIZE], columns=['id', 'type', 'symbol', 'qty', 'price', 'com', 'currency', 'date'])
+                offset = (len(pager["cursors"]) - 1) * db.PAGE_SIZE
+                df_tx.insert(0, 'No.', range(offset + 1, offset + len(df_tx) + 1))
+
+                event_tx = st.dataframe(
+                    df_tx,
+                    use_container_width=True,
+                    hide_index=True,
+                    on_select="rerun",
+                    selection_mode="single-row",
+                    key=f"history_table_v2_{pager['gen']}"
+                )
+                page_controls("tx_pager", pager, rows, total)
 
             if len(event_tx.selection.rows) > 0:
                 idx = event_tx.selection.rows[0]
@@ -290,15 +496,14 @@ def main_page():
         
         wd_action_container = st.container()
 
-        if withdrawals:
-            df_wd = pd.DataFrame(withdrawals)
-            
-            df_wd = df_wd.sort_values(by='id', ascending=False)
-            
-            df_wd['No.'] = range(1, len(df_wd) + 1)
-            
-            cols_wd = ['No.', 'id'] + [c for c in df_wd.columns if c not in ['No.', 'id']]
-            df_wd = df_wd[cols_wd]
+        wd_count = db.count_wd_db(current_user_id)
+        if wd_count:
+            pager_wd = history_pager("wd_pager", ())
+            rows_wd = db.get_wd_page_db(current_user_id, pager_wd["cursors"][-1], db.PAGE_SIZE + 1)
+
+            df_wd = pd.DataFrame(rows_wd[:db.PAGE_SIZE], columns=['id', 'amount', 'currency', 'date', 'type'])
+            offset_wd = (len(pager_wd["cursors"]) - 1) * db.PAGE_SIZE
+            df_wd.insert(0, 'No.', range(offset_wd + 1, offset_wd + len(df_wd) + 1))
 
             event_wd = st.dataframe(
                 df_wd,
@@ -306,8 +511,9 @@ def main_page():
                 hide_index=True,
                 on_select="rerun",
                 selection_mode="single-row",
-                key="wd_table_v2"
+                key=f"wd_table_v2_{pager_wd['gen']}"
             )
+            page_controls("wd_pager", pager_wd, rows_wd, wd_count)
 
             if len(event_wd.selection.rows) > 0:
                 idx_wd = event_wd.selection.rows[0]
@@ -321,6 +527,12 @@ def main_page():
         else:
             st.info("No withdrawals yet.")
 
+    st.sidebar.divider()
+    st.sidebar.toggle("Performance", key="perf_panel")
+    recorder = perf.finish(user_id=current_user_id, ledger_version=ledger_version)
+    if recorder is not None and st.session_state.get("perf_panel"):
+        performance_panel(recorder)
+
 if st.session_state.logged_in:
     main_page()
 else:
@@ -0,0 +1,330 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import database as db
+import market_data
+import price_store
+
+# Usage: python bench.py --tx 1000 100000 --symbols 10 100 --years 5 20 --out bench_report.json
+# Everything runs against temporary SQLite files and the local market-data
+# backend, so results are reproducible and need no network.
+
+# Server time for a cold login page render, and the modules it must not load.
+LOGIN_BUDGET_MS = 100
+HEAVY_MODULES = ("pandas", "numpy", "yfinance", "streamlit_autorefresh", "pyarrow")
+
+
+def synthetic_ledger(n_tx, n_symbols, years, seed=0):
+    rng = random.Random(seed)
+    symbols = [f"SYM{i:04d}" for i in range(n_symbols)]
+    provider = market_data.get_provider()
+    end = datetime.date.today() - datetime.timedelta(days=1)
+    start = end - datetime.timedelta(days=int(years * 365.25))
+    span = (end - start).days
+
+    last_prices = {s: provider.last_price(s) for s in symbols}
+
+    offsets = sorted(rng.randrange(span + 1) for _ in range(n_tx))
+    held = {}
+    transactions = []
+    for i, offset in enumerate(offsets):
+        date = start + datetime.timedelta(days=offset)
+        symbol = rng.choice(symbols)
+        price = round(last_prices[symbol] * rng.uniform(0.5, 1.5), 4)
+        if held.get(symbol, 0) > 0 and rng.random() < 0.3:
+            tx_type = "SELL"
+            qty = round(held[symbol] * rng.uniform(0.1, 1.0), 4)
+            held[symbol] -= qty
+        else:
+            tx_type = "BUY"
+            qty = float(rng.randint(1, 100))
+            held[symbol] = held.get(symbol, 0) + qty
+        transactions.append({
+            "id": i + 1,
+            "type": tx_type,
+            "symbol": symbol,
+            "qty": qty,
+            "price": price,
+            "com": round(rng.uniform(0, 5), 2),
+            "date": date.strftime("%Y-%m-%d"),
+        })
+    return transactions
+
+
+def measure(fn, repeat, trace=True):
+    # Timed runs are untraced; peak memory comes from one extra traced run
+    # because tracemalloc itself slows allocation-heavy code considerably.
+    timings = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - t0)
+
+    peak = 0
+    if trace:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, {
+        "seconds_min": min(timings),
+        "seconds_median": statistics.median(timings),
+        "peak_mb": round(peak / 2 ** 20, 3),
+    }
+
+
+def load_ledger(user_id, transactions):
+    db.add_tx_many_db(user_id, transactions)
+
+
+def run_main_page(user_id):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"), default_timeout=600)
+    at.session_state["logged_in"] = True
+    at.session_state["user_id"] = user_id
+    at.session_state["username"] = "bench"
+    at.session_state["show_register"] = False
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+
+# Runs in a fresh interpreter that has only streamlit imported, as in a
+# running server, and executes app.py in bare mode with no session: that is
+# the login page. bench.py itself is not imported, since it pulls in pandas.
+STARTUP_PROBE = """
+import json, logging, os, runpy, sys, tempfile, time
+import streamlit.delta_generator
+logging.disable(logging.CRITICAL)
+# Bare mode's one-off "use streamlit run" check walks the whole stack; a
+# server never does it.
+streamlit.delta_generator._use_warning_has_been_displayed = True
+app, heavy = sys.argv[1], sys.argv[2].split(",")
+sys.path.insert(0, os.path.dirname(app))
+with tempfile.TemporaryDirectory() as tmp:
+    os.chdir(tmp)
+    before = set(sys.modules)
+    t0 = time.perf_counter()
+    runpy.run_path(app, run_name="__main__")
+    cold = time.perf_counter() - t0
+    loaded = sorted(m for m in heavy if m in sys.modules and m not in before)
+    t0 = time.perf_counter()
+    runpy.run_path(app, run_name="__main__")
+    rerun = time.perf_counter() - t0
+print(json.dumps({"login_cold_ms": cold * 1000, "login_rerun_ms": rerun * 1000, "heavy_imports": loaded}))
+"""
+
+
+def measure_startup(repeat):
+    runs = []
+    for _ in range(repeat):
+        app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+        out = subprocess.check_output([sys.executable, "-c", STARTUP_PROBE, app, ",".join(HEAVY_MODULES)],
+                                      text=True, stderr=subprocess.DEVNULL)
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    result = {
+        "login_cold_ms": statistics.median(r["login_cold_ms"] for r in runs),
+        "login_rerun_ms": statistics.median(r["login_rerun_ms"] for r in runs),
+        "heavy_imports": runs[-1]["heavy_imports"],
+        "budget_ms": LOGIN_BUDGET_MS,
+    }
+    result["within_budget"] = result["login_cold_ms"] <= LOGIN_BUDGET_MS
+    print(f"login page  cold {result['login_cold_ms']:.1f} ms  rerun {result['login_rerun_ms']:.1f} ms  "
+          f"budget {LOGIN_BUDGET_MS} ms  {'ok' if result['within_budget'] else 'OVER'}  "
+          f"heavy imports: {', '.join(result['heavy_imports']) or 'none'}", file=sys.stderr)
+    return result
+
+
+def run_case(n_tx, n_symbols, years, args):
+    from function import Ledger, get_holdings, calculate_port, port_history
+
+    case = {"transactions": n_tx, "symbols": n_symbols, "years": years}
+    results = []
+
+    def record(stage, fn, repeat=args.repeat, trace=True):
+        value, stats = measure(fn, repeat, trace and not args.no_memory)
+        results.append({"case": case, "stage": stage, **stats})
+        print(f"{n_tx:>8} tx {n_symbols:>5} sym {years:>3}y  {stage:<22} {stats['seconds_median']:.4f}s  {stats['peak_mb']:.1f} MiB",
+              file=sys.stderr)
+        return value
+
+    transactions = record("generate", lambda: synthetic_ledger(n_tx, n_symbols, years, args.seed), repeat=1, trace=False)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, "portfolio.db")
+        price_store.PRICE_DB_NAME = os.path.join(tmp, "prices.db")
+        price_store._ready = False
+        db.init_db()
+        db.add_user("bench", "bench")
+        user_id = db.login_user("bench", "bench")[0][0]
+
+        record("db_load", lambda: load_ledger(user_id, transactions), repeat=1, trace=False)
+        record("get_tx_db", lambda: db.get_tx_db(user_id))
+        columns = record("get_tx_columns", lambda: db.get_tx_columns(user_id))
+        # What the loaded arrays themselves hold, next to the load's peak.
+        results[-1]["resident_mb"] = round(columns.nbytes() / 2 ** 20, 3)
+        record("ledger", lambda: Ledger(transactions))
+        record("ledger_columns", lambda: Ledger(columns))
+        record("get_holdings", lambda: get_holdings(transactions))
+        record("calculate_port", lambda: calculate_port(transactions))
+        record("port_history_cold", lambda: port_history(transactions), repeat=1, trace=False)
+        record("port_history", lambda: port_history(transactions))
+        if args.scenarios:
+            from scenarios import simulate
+            rules = scenario_sweep(args.scenarios)
+            record(f"scenarios_{len(rules)}", lambda: simulate(transactions, rules))
+        if args.main_page:
+            record("main_page", lambda: run_main_page(user_id))
+
+    return results
+
+
+def scenario_sweep(n_rules):
+    # Half substitutes, half rebalancing mixes at varying weights and frequencies.
+    targets = ["QQQ", "SPY", "AGG", "VT"]
+    rules = [{"substitute": targets[i % len(targets)]} for i in range(n_rules // 2)]
+    n_mixes = n_rules - len(rules)
+    for i in range(n_mixes):
+        w = i / max(n_mixes - 1, 1)
+        rules.append({"rebalance": {"SPY": w, "AGG": 1 - w}, "every": ("M", "Q", "Y", None)[i % 4]})
+    return rules
+
+
+def _direct_write(fn, *args):
+    # What every write did before the writer thread: its own pooled
+    # connection, transaction and commit.
+    with db.get_conn() as conn, conn:
+        return fn(conn.cursor(), *args)
+
+
+def measure_writers(n_writers, n_writes, mode, seed=0):
+    # n_writers threads, one simulated session each, adding n_writes trades
+    # and withdrawals and deleting every fifth row they added.
+    write = db.write if mode == "queued" else _direct_write
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(n_writers)
+
+    def session(user_id):
+        rng = random.Random(seed + user_id)
+        mine = []
+        barrier.wait()
+        for i in range(n_writes):
+            date = (datetime.date(2020, 1, 1) + datetime.timedelta(days=rng.randrange(1500))).isoformat()
+            t0 = time.perf_counter()
+            try:
+                if i % 10 == 9:
+                    write(db._add_wd, user_id, 1.0, date)
+                elif i % 5 == 4 and mine:
+                    write(db._delete_tx, mine.pop())
+                else:
+                    mine.append(write(db._add_tx, user_id, "BUY", f"SYM{rng.randrange(20):04d}", 1.0, 100.0, 0.0, date))
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, f"writers_{mode}.db")
+        db.init_db()
+        for i in range(n_writers):
+            db.add_user(f"writer{i}", "bench")
+        threads = [threading.Thread(target=session, args=(i + 1,)) for i in range(n_writers)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    result = {
+        "mode": mode,
+        "writers": n_writers,
+        "writes": len(latencies),
+        "errors": len(errors),
+        "seconds": elapsed,
+        "writes_per_second": len(latencies) / elapsed if elapsed else None,
+        "latency_p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else None,
+        "latency_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+    }
+    print(f"{n_writers:>4} writers  {mode:<7} {result['writes_per_second']:>9.0f} writes/s  "
+          f"p50 {result['latency_p50_ms']:.2f} ms  p99 {result['latency_p99_ms']:.2f} ms  errors {len(errors)}",
+          file=sys.stderr)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ledger, history and database hot paths.")
+    parser.add_argument("--tx", type=int, nargs="+", default=[100, 10000])
+    parser.add_argument("--symbols", type=int, nargs="+", default=[10])
+    parser.add_argument("--years", type=int, nargs="+", default=[10])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--main-page", action="store_true", help="also render app.main_page through streamlit's AppTest")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced run used for peak memory")
+    parser.add_argument("--startup", action="store_true", help="also time a cold login page render against LOGIN_BUDGET_MS")
+    parser.add_argument("--writers", type=int, nargs="+", default=[],
+                        help="also measure write throughput with this many concurrent sessions, direct vs queued")
+    parser.add_argument("--writes", type=int, default=200, help="writes per session for --writers")
+    parser.add_argument("--scenarios", type=int, default=0, help="also time a what-if sweep of this many rules per case")
+    parser.add_argument("--out", default="bench_report.json")
+    args = parser.parse_args(argv)
+
+
+    os.environ[market_data.PROVIDER_ENV] = "local"
+    market_data.set_provider(market_data.LocalProvider(seed=args.seed))
+
+    import numpy as np
+    import pandas as pd
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": [],
+    }
+    if args.startup:
+        report["startup"] = measure_startup(args.repeat)
+    if args.writers:
+        report["writers"] = [measure_writers(n, args.writes, mode, args.seed)
+                             for n in args.writers for mode in ("direct", "queued")]
+    for n_tx, n_symbols, years in itertools.product(args.tx, args.symbols, args.years):
+        report["results"].extend(run_case(n_tx, n_symbols, years, args))
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
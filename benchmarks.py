@@ -0,0 +1,39 @@
+# Benchmark specs. A spec is a ticker ("QQQ") or a weighted mix of tickers
+# ("SPY*0.6+AGG*0.4"); a mix is bought at its weights on the first day and
+# held, and weights are normalized to sum to 1. Benchmarks are compared in
+# their own currency.
+
+DEFAULT_BENCHMARKS = ["^GSPC"]
+
+PRESETS = {
+    "^GSPC": "S&P 500",
+    "QQQ": "Nasdaq 100",
+    "^SET.BK": "SET Index",
+    "SPY*0.6+AGG*0.4": "60/40 Mix",
+}
+
+
+def parse_benchmark(spec):
+    # Returns {symbol: weight}; raises ValueError for a malformed spec.
+    # users.benchmarks joins specs with commas, so a spec cannot hold one.
+    if "," in spec:
+        raise ValueError(f"Benchmark cannot contain ',': {spec!r}")
+    weights = {}
+    for part in spec.replace(" ", "").upper().split("+"):
+        symbol, _, weight = part.partition("*")
+        if not symbol:
+            raise ValueError(f"Bad benchmark: {spec!r}")
+        try:
+            weights[symbol] = weights.get(symbol, 0.0) + float(weight or 1.0)
+        except ValueError:
+            raise ValueError(f"Bad benchmark weight: {spec!r}")
+    total = sum(weights.values())
+    if total <= 0 or min(weights.values()) < 0:
+        raise ValueError(f"Bad benchmark weights: {spec!r}")
+    return {symbol: w / total for symbol, w in weights.items()}
+
+def benchmark_symbols(specs):
+    return list(dict.fromkeys(s for spec in specs for s in parse_benchmark(spec)))
+
+def benchmark_label(spec):
+    return PRESETS.get(spec.replace(" ", "").upper(), spec)
@@ -1,98 +1,692 @@
 import sqlite3
+import datetime
 import hashlib
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from benchmarks import DEFAULT_BENCHMARKS
+from fx import BASE_CURRENCY, CURRENCIES, CURRENCY_NAMES, currency_code, symbol_currency
+from ledger import apply_trade, TYPE_CODES, TYPE_NAMES
 
 DB_NAME = "portfolio.db"
 
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users 
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                  username TEXT UNIQUE, 
+POOL_SIZE = 8
+
+# Rows per page of the trade and withdrawal history.
+PAGE_SIZE = 50
+
+# Share counts within this of zero are a closed position; replaying in
+# today's shares can leave a float residue behind.
+QTY_EPSILON = 1e-9
+
+# Ledger rows store dates as days since EPOCH, types as TxType codes and
+# currencies as ISO 4217 numeric codes; these expressions turn them back into
+# the strings the rest of the app works with.
+EPOCH = datetime.date(1970, 1, 1)
+TYPE_SQL = "CASE t.type " + " ".join(f"WHEN {code} THEN '{name}'" for name, code in TYPE_CODES.items()) + " END"
+DATE_SQL = "date(t.day * 86400, 'unixepoch')"
+CURRENCY_SQL = "CASE t.currency " + " ".join(f"WHEN {code} THEN '{name}'" for name, code in CURRENCIES.items()) + " END"
+TX_SELECT = (f"SELECT t.id, {TYPE_SQL} AS type, s.symbol, t.qty, t.price, t.com, {DATE_SQL} AS date, "
+             f"{CURRENCY_SQL} AS currency FROM transactions t LEFT JOIN symbols s ON s.id = t.symbol_id")
+WD_SELECT = f"SELECT t.id, t.amount, {DATE_SQL} AS date, {CURRENCY_SQL} AS currency FROM withdrawals t"
+
+# Streamlit runs every rerun on a fresh thread, so connections are pooled
+# (per database file) instead of being tied to a thread.
+_pools = {}
+_pools_lock = threading.Lock()
+_initialized = set()
+
+# Writes go through one writer thread per database file, which owns the only
+# write connection. Whatever is queued when it wakes is committed as one
+# transaction, each request inside its own savepoint, so concurrent sessions
+# never wait on SQLite's write lock and share one sync per batch.
+MAX_BATCH = 256
+_writers = {}
+
+def _connect(db_name):
+    conn = sqlite3.connect(db_name, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-16000')
+    conn.execute('PRAGMA mmap_size=268435456')
+    return conn
+
+@contextmanager
+def get_conn():
+    db_name = DB_NAME
+    with _pools_lock:
+        pool = _pools.setdefault(db_name, queue.LifoQueue())
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _connect(db_name)
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        if pool.qsize() < POOL_SIZE:
+            pool.put(conn)
+        else:
+            conn.close()
+
+class _Writer:
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, args):
+        future = Future()
+        self.jobs.put((fn, args, future))
+        return future
+
+    def _run(self):
+        conn = _connect(self.db_name)
+        conn.isolation_level = None
+        while True:
+            batch = [self.jobs.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(conn, batch)
+
+    def _commit(self, conn, batch):
+        c = conn.cursor()
+        done = []
+        try:
+            c.execute('BEGIN IMMEDIATE')
+            for fn, args, future in batch:
+                c.execute('SAVEPOINT job')
+                try:
+                    done.append((future, fn(c, *args), None))
+                    c.execute('RELEASE job')
+                except Exception as e:
+                    c.execute('ROLLBACK TO job')
+                    c.execute('RELEASE job')
+                    done.append((future, None, e))
+            c.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for future, result, error in done:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+def write(fn, *args):
+    # Runs fn(cursor, *args) on the writer thread and waits for its batch to
+    # commit. Returns fn's result or raises its exception.
+    db_name = DB_NAME
+    with _pools_lock:
+        writer = _writers.get(db_name)
+        # A forked worker process inherits the dict but not the thread.
+        if writer is None or not writer.thread.is_alive():
+            writer = _writers[db_name] = _Writer(db_name)
+    return writer.submit(fn, args).result()
+
+def _migrate_v1(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS users
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  username TEXT UNIQUE,
                   password TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS transactions 
+    c.execute('''CREATE TABLE IF NOT EXISTS transactions
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
                   user_id INTEGER,
                   type TEXT, symbol TEXT, qty REAL, price REAL, com REAL, date TEXT,
                   FOREIGN KEY(user_id) REFERENCES users(id))''')
-    c.execute('''CREATE TABLE IF NOT EXISTS withdrawals 
+    c.execute('''CREATE TABLE IF NOT EXISTS withdrawals
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
                   user_id INTEGER,
                   amount REAL, date TEXT,
                   FOREIGN KEY(user_id) REFERENCES users(id))''')
-    conn.commit()
-    conn.close()
+    c.execute('''CREATE TABLE IF NOT EXISTS positions
+                 (user_id INTEGER, symbol TEXT,
+                  qty REAL, total_cost REAL, realized_pnl REAL,
+                  PRIMARY KEY(user_id, symbol),
+                  FOREIGN KEY(user_id) REFERENCES users(id))''')
+    # positions is backfilled by _migrate_v8, once the ledger is in its final layout.
+
+def _migrate_v2(c):
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tx_user_date ON transactions(user_id, date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tx_user_symbol ON transactions(user_id, symbol)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_wd_user_date ON withdrawals(user_id, date)')
+
+def _migrate_v3(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS ledger_versions
+                 (user_id INTEGER PRIMARY KEY, version INTEGER,
+                  FOREIGN KEY(user_id) REFERENCES users(id))''')
+
+def _migrate_v4(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS nav_history
+                 (user_id INTEGER, date TEXT,
+                  stock_value REAL, cash REAL, invested REAL, roi REAL,
+                  PRIMARY KEY(user_id, date)) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS nav_checkpoints
+                 (user_id INTEGER, symbol TEXT, date TEXT,
+                  qty REAL, cost REAL,
+                  PRIMARY KEY(user_id, symbol, date)) WITHOUT ROWID''')
+    c.execute('''CREATE TABLE IF NOT EXISTS nav_dirty
+                 (user_id INTEGER PRIMARY KEY, from_date TEXT)''')
+
+def _migrate_v5(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS user_summary
+                 (user_id INTEGER PRIMARY KEY, ledger_version INTEGER,
+                  sell_revenue REAL, invested REAL, realized_pnl REAL, computed_at REAL,
+                  FOREIGN KEY(user_id) REFERENCES users(id))''')
+
+def _migrate_v6(c):
+    # Keyset pagination walks a user's rows by id.
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tx_user_id ON transactions(user_id, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_wd_user_id ON withdrawals(user_id, id)')
+
+def _migrate_v7(c):
+    # nav_history now nets withdrawals out of cash and records each day's
+    # external flow, so the stored series is rebuilt on next read.
+    c.execute('ALTER TABLE nav_history ADD COLUMN flow REAL DEFAULT 0')
+    c.execute('DELETE FROM nav_history')
+    c.execute('DELETE FROM nav_checkpoints')
+    c.execute('''CREATE TABLE IF NOT EXISTS risk_state
+                 (user_id INTEGER PRIMARY KEY, through_date TEXT, state TEXT)''')
+
+def _migrate_v8(c):
+    # Normalized ledger: tickers move to a symbols table, dates become epoch
+    # days and types TxType codes. Rows keep their ids, and every converted
+    # row must round-trip to the original text before the old tables go.
+    c.execute("""CREATE TABLE IF NOT EXISTS symbols
+                 (id INTEGER PRIMARY KEY, symbol TEXT UNIQUE NOT NULL)""")
+    c.execute("""INSERT OR IGNORE INTO symbols(symbol)
+                 SELECT DISTINCT symbol FROM transactions WHERE symbol IS NOT NULL AND symbol != '' ORDER BY symbol""")
+
+    type_code = "CASE t.type " + " ".join(f"WHEN '{name}' THEN {code}" for name, code in TYPE_CODES.items()) + " END"
+    to_day = "CAST(julianday(date(t.date)) - 2440587.5 AS INTEGER)"
+    c.execute('DROP TABLE IF EXISTS transactions_v8')
+    c.execute("""CREATE TABLE transactions_v8
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_id INTEGER, type INTEGER, symbol_id INTEGER,
+                  qty REAL, price REAL, com REAL, day INTEGER,
+                  FOREIGN KEY(user_id) REFERENCES users(id),
+                  FOREIGN KEY(symbol_id) REFERENCES symbols(id))""")
+    c.execute(f"""INSERT INTO transactions_v8(id, user_id, type, symbol_id, qty, price, com, day)
+                  SELECT t.id, t.user_id, {type_code}, s.id, t.qty, t.price, t.com, {to_day}
+                  FROM transactions t LEFT JOIN symbols s ON s.symbol = t.symbol""")
+    c.execute('DROP TABLE IF EXISTS withdrawals_v8')
+    c.execute("""CREATE TABLE withdrawals_v8
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_id INTEGER, amount REAL, day INTEGER,
+                  FOREIGN KEY(user_id) REFERENCES users(id))""")
+    c.execute(f'INSERT INTO withdrawals_v8(id, user_id, amount, day) SELECT t.id, t.user_id, t.amount, {to_day} FROM withdrawals t')
+
+    c.execute("""SELECT COUNT(*) FROM transactions t JOIN transactions_v8 n ON n.id = t.id LEFT JOIN symbols s ON s.id = n.symbol_id
+                  WHERE n.type IS NULL AND t.type IS NOT NULL
+                     OR COALESCE(s.symbol, '') != COALESCE(t.symbol, '')
+                     OR date(n.day * 86400, 'unixepoch') IS NOT t.date""")
+    bad_tx = c.fetchone()[0]
+    c.execute("""SELECT COUNT(*) FROM withdrawals t JOIN withdrawals_v8 n ON n.id = t.id
+                 WHERE date(n.day * 86400, 'unixepoch') IS NOT t.date""")
+    bad_wd = c.fetchone()[0]
+    if bad_tx or bad_wd:
+        raise RuntimeError(f"Cannot convert ledger: {bad_tx} transaction(s) and {bad_wd} withdrawal(s) "
+                           "have a type or date that is not BUY/SELL and YYYY-MM-DD")
+
+    c.execute("SELECT name, seq FROM sqlite_sequence WHERE name IN ('transactions', 'withdrawals')")
+    sequences = c.fetchall()
+    for table in ('transactions', 'withdrawals'):
+        c.execute(f'DROP TABLE {table}')
+        c.execute(f'ALTER TABLE {table}_v8 RENAME TO {table}')
+    # Ids of deleted rows are never handed out again.
+    for table, seq in sequences:
+        c.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (seq, table))
+        if c.rowcount == 0:
+            c.execute('INSERT INTO sqlite_sequence(name, seq) VALUES (?, ?)', (table, seq))
+
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tx_user_day ON transactions(user_id, day)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tx_user_symbol ON transactions(user_id, symbol_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tx_user_id ON transactions(user_id, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_wd_user_day ON withdrawals(user_id, day)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_wd_user_id ON withdrawals(user_id, id)')
+
+    c.execute('DELETE FROM positions')
+    c.execute('SELECT DISTINCT t.user_id, s.symbol FROM transactions t JOIN symbols s ON s.id = t.symbol_id')
+    for user_id, symbol in c.fetchall():
+        _rebuild_position(c, user_id, symbol)
+
+def _migrate_v9(c):
+    # The split factors each user's stored NAV series was computed with.
+    c.execute('''CREATE TABLE IF NOT EXISTS nav_splits
+                 (user_id INTEGER PRIMARY KEY, signature TEXT)''')
+
+def _migrate_v10(c):
+    # Rows entered so far were priced in their listing's currency, and
+    # withdrawals were entered in USD.
+    c.execute('ALTER TABLE transactions ADD COLUMN currency INTEGER')
+    c.execute('ALTER TABLE withdrawals ADD COLUMN currency INTEGER')
+    c.execute(f"ALTER TABLE users ADD COLUMN base_currency INTEGER DEFAULT {CURRENCIES[BASE_CURRENCY]}")
+    c.execute('SELECT id, symbol FROM symbols')
+    c.executemany('UPDATE transactions SET currency = ? WHERE symbol_id = ?',
+                  [(currency_code(symbol_currency(symbol)), symbol_id) for symbol_id, symbol in c.fetchall()])
+    c.execute('UPDATE transactions SET currency = ? WHERE currency IS NULL', (CURRENCIES[BASE_CURRENCY],))
+    c.execute('UPDATE withdrawals SET currency = ?', (CURRENCIES[BASE_CURRENCY],))
+
+def _migrate_v11(c):
+    # Comma-separated benchmark specs shown on a user's chart.
+    c.execute(f"ALTER TABLE users ADD COLUMN benchmarks TEXT DEFAULT '{','.join(DEFAULT_BENCHMARKS)}'")
+
+def _migrate_v12(c):
+    # The split factors (price_store.splits_signature) a summary was computed with.
+    c.execute("ALTER TABLE user_summary ADD COLUMN splits TEXT DEFAULT '{}'")
+
+MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6, _migrate_v7, _migrate_v8,
+              _migrate_v9, _migrate_v10, _migrate_v11, _migrate_v12]
+
+def init_db():
+    # The whole chain runs in one explicit transaction: in sqlite3's default
+    # mode DDL commits on its own, so a migration failing halfway would leave
+    # earlier ALTERs applied under the old schema_version.
+    if DB_NAME in _initialized: return
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+        if c.fetchone():
+            c.execute('SELECT version FROM schema_version')
+            row = c.fetchone()
+            if row and row[0] >= len(MIGRATIONS):
+                _initialized.add(DB_NAME)
+                return
+        conn.isolation_level = None
+        try:
+            c = conn.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            try:
+                c.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER)')
+                c.execute('SELECT version FROM schema_version')
+                row = c.fetchone()
+                version = row[0] if row else 0
+                for migrate in MIGRATIONS[version:]:
+                    migrate(c)
+                if version < len(MIGRATIONS):
+                    c.execute('DELETE FROM schema_version')
+                    c.execute('INSERT INTO schema_version(version) VALUES (?)', (len(MIGRATIONS),))
+                c.execute('COMMIT')
+            except BaseException:
+                c.execute('ROLLBACK')
+                raise
+        finally:
+            conn.isolation_level = ''
+    _initialized.add(DB_NAME)
+
+def _apply_position(c, user_id, tx_type, symbol, qty, price, com):
+    c.execute('SELECT qty, total_cost, realized_pnl FROM positions WHERE user_id = ? AND symbol = ?',
+              (user_id, symbol))
+    row = c.fetchone()
+    if row is None:
+        if tx_type != "BUY": return
+        row = (0.0, 0.0, 0.0)
+    position = [row[0], row[1]]
+    pnl = apply_trade(position, tx_type, qty, price, com)
+    c.execute('INSERT OR REPLACE INTO positions(user_id, symbol, qty, total_cost, realized_pnl) VALUES (?,?,?,?,?)',
+              (user_id, symbol, position[0], position[1], row[2] + pnl))
+
+def _bump_version(c, user_id, date=None):
+    # Any write to a user's ledger invalidates results cached under the old
+    # version, and the stored NAV series from the write's date onwards.
+    c.execute('''INSERT INTO ledger_versions(user_id, version) VALUES (?, 1)
+                 ON CONFLICT(user_id) DO UPDATE SET version = version + 1''', (user_id,))
+    if date:
+        c.execute('''INSERT INTO nav_dirty(user_id, from_date) VALUES (?, ?)
+                     ON CONFLICT(user_id) DO UPDATE SET from_date = MIN(from_date, excluded.from_date)''',
+                  (user_id, date))
+
+def to_day(date):
+    # 'YYYY-MM-DD' (or a date) -> days since EPOCH.
+    if date is None: return None
+    if not isinstance(date, datetime.date):
+        date = datetime.date.fromisoformat(str(date)[:10])
+    return (date - EPOCH).days
+
+def from_day(day):
+    return (EPOCH + datetime.timedelta(days=day)).isoformat()
+
+def _symbol_id(c, symbol):
+    if not symbol: return None
+    c.execute('INSERT OR IGNORE INTO symbols(symbol) VALUES (?)', (symbol,))
+    c.execute('SELECT id FROM symbols WHERE symbol = ?', (symbol,))
+    return c.fetchone()[0]
+
+def _rebuild_position(c, user_id, symbol):
+    # Replays a single symbol in ledger order; used when a row is removed mid-history.
+    c.execute('DELETE FROM positions WHERE user_id = ? AND symbol = ?', (user_id, symbol))
+    c.execute('''SELECT type, qty, price, com FROM transactions
+                 WHERE user_id = ? AND symbol_id = (SELECT id FROM symbols WHERE symbol = ?) ORDER BY id''',
+              (user_id, symbol))
+    position = None
+    for tx_type, qty, price, com in c.fetchall():
+        tx_type = TYPE_NAMES[tx_type] if tx_type is not None else None
+        if position is None:
+            if tx_type != "BUY": continue
+            position = [0.0, 0.0, 0.0]
+        position[2] += apply_trade(position, tx_type, qty, price, com)
+    if position is not None:
+        c.execute('INSERT INTO positions(user_id, symbol, qty, total_cost, realized_pnl) VALUES (?,?,?,?,?)',
+                  (user_id, symbol, position[0], position[1], position[2]))
 
 def make_hash(password):
     return hashlib.sha256(str.encode(password)).hexdigest()
 
+def _add_user(c, username, password):
+    c.execute('INSERT INTO users(username, password) VALUES (?,?)', (username, make_hash(password)))
+
 def add_user(username, password):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
     try:
-        c.execute('INSERT INTO users(username, password) VALUES (?,?)', 
-                  (username, make_hash(password)))
-        conn.commit()
+        write(_add_user, username, password)
         return True
     except:
         return False
-    finally:
-        conn.close()
 
 def login_user(username, password):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('SELECT * FROM users WHERE username = ? AND password = ?', 
-              (username, make_hash(password)))
-    data = c.fetchall()
-    conn.close()
-    return data
-
-def add_tx_db(user_id, tx_type, symbol, qty, price, com, date):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('INSERT INTO transactions(user_id, type, symbol, qty, price, com, date) VALUES (?,?,?,?,?,?,?)',
-              (user_id, tx_type, symbol, qty, price, com, date))
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT * FROM users WHERE username = ? AND password = ?',
+                  (username, make_hash(password)))
+        return c.fetchall()
+
+def _position_qty(c, user_id, symbol, splits=None):
+    # positions holds traded quantities; a symbol in splits
+    # (price_store.split_factors) is replayed in today's shares instead.
+    if splits and symbol in splits:
+        from ledger import Ledger
+        return Ledger(_tx_columns(c, user_id, [symbol]).adjusted(splits)).qty(symbol)
+    c.execute('SELECT qty FROM positions WHERE user_id = ? AND symbol = ?', (user_id, symbol))
+    row = c.fetchone()
+    return row[0] if row else 0.0
+
+def _position_currency(c, user_id, symbol, splits=None):
+    # An open position is kept in one currency: that of the trades that built it.
+    if _position_qty(c, user_id, symbol, splits) <= QTY_EPSILON: return None
+    c.execute('''SELECT currency FROM transactions WHERE user_id = ? AND symbol_id = (SELECT id FROM symbols WHERE symbol = ?)
+                 ORDER BY id DESC LIMIT 1''', (user_id, symbol))
+    row = c.fetchone()
+    return CURRENCY_NAMES.get(row[0]) if row else None
+
+def get_position_currency_db(user_id, symbol, splits=None):
+    with get_conn() as conn:
+        return _position_currency(conn.cursor(), user_id, symbol, splits)
+
+def _add_tx(c, user_id, tx_type, symbol, qty, price, com, date, currency=None, splits=None):
+    currency = currency or symbol_currency(symbol)
+    held_in = _position_currency(c, user_id, symbol, splits) if symbol else None
+    if held_in and held_in != currency:
+        raise ValueError(f"{symbol} is held in {held_in}; trades in {currency} are not allowed")
+    c.execute('INSERT INTO transactions(user_id, type, symbol_id, qty, price, com, day, currency) VALUES (?,?,?,?,?,?,?,?)',
+              (user_id, TYPE_CODES.get(tx_type), _symbol_id(c, symbol), qty, price, com, to_day(date),
+               currency_code(currency)))
+    tx_id = c.lastrowid
+    if symbol:
+        _apply_position(c, user_id, tx_type, symbol, qty, price, com)
+    _bump_version(c, user_id, date)
+    return tx_id
+
+def add_tx_db(user_id, tx_type, symbol, qty, price, com, date, currency=None, splits=None):
+    # currency defaults to the symbol's quote currency.
+    return write(_add_tx, user_id, tx_type, symbol, qty, price, com, date, currency, splits)
+
+def _add_tx_many(c, user_id, rows):
+    symbol_ids = {s: _symbol_id(c, s) for s in {r["symbol"] for r in rows}}
+    c.executemany('INSERT INTO transactions(user_id, type, symbol_id, qty, price, com, day, currency) VALUES (?,?,?,?,?,?,?,?)',
+                  [(user_id, TYPE_CODES.get(r["type"]), symbol_ids[r["symbol"]], r["qty"], r["price"], r["com"], to_day(r["date"]),
+                    currency_code(r.get("currency") or symbol_currency(r["symbol"])))
+                   for r in rows])
+    for symbol in {r["symbol"] for r in rows if r["symbol"]}:
+        _rebuild_position(c, user_id, symbol)
+    if rows:
+        _bump_version(c, user_id, min(r["date"] for r in rows))
+
+def add_tx_many_db(user_id, rows):
+    # Bulk path for imports: one executemany in one job, then each touched
+    # symbol's position is replayed once rather than updated row by row.
+    write(_add_tx_many, user_id, rows)
 
 def get_tx_db(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT id, type, symbol, qty, price, com, date FROM transactions WHERE user_id = ?', (user_id,))
-    data = c.fetchall()
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        c.execute(f'{TX_SELECT} WHERE t.user_id = ? ORDER BY t.id', (user_id,))
+        data = c.fetchall()
     return [dict(row) for row in data]
 
+def _history_where(user_id, symbol=None, start=None, end=None, before_id=None):
+    where, params = ['t.user_id = ?'], [user_id]
+    if symbol:
+        where.append('t.symbol_id = (SELECT id FROM symbols WHERE symbol = ?)'); params.append(symbol)
+    if start:
+        where.append('t.day >= ?'); params.append(to_day(start))
+    if end:
+        where.append('t.day <= ?'); params.append(to_day(end))
+    if before_id is not None:
+        where.append('t.id < ?'); params.append(before_id)
+    return ' AND '.join(where), params
+
+def get_tx_page_db(user_id, before_id=None, limit=PAGE_SIZE, symbol=None, start=None, end=None):
+    # Newest first; pass the last id of a page as before_id to get the next one.
+    where, params = _history_where(user_id, symbol, start, end, before_id)
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        c.execute(f'{TX_SELECT} WHERE {where} ORDER BY t.id DESC LIMIT ?', params + [limit])
+        return [dict(row) for row in c.fetchall()]
+
+def count_tx_db(user_id, symbol=None, start=None, end=None):
+    where, params = _history_where(user_id, symbol, start, end)
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(f'SELECT COUNT(*) FROM transactions t WHERE {where}', params)
+        return c.fetchone()[0]
+
+def get_tx_symbols_db(user_id):
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('''SELECT symbol FROM symbols WHERE id IN (SELECT DISTINCT symbol_id FROM transactions WHERE user_id = ?)
+                     ORDER BY symbol''', (user_id,))
+        return [r[0] for r in c.fetchall()]
+
+def get_ledger_version_db(user_id):
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT version FROM ledger_versions WHERE user_id = ?', (user_id,))
+        row = c.fetchone()
+    return row[0] if row else 0
+
+def _tx_columns(c, user_id, symbols=None):
+    from tx_columns import TxColumns
+    where, params = 'user_id = ?', [user_id]
+    if symbols is not None:
+        where += f' AND symbol_id IN (SELECT id FROM symbols WHERE symbol IN ({",".join("?" * len(symbols))}))'
+        params += list(symbols)
+    c.execute(f'SELECT id, symbol FROM symbols WHERE id IN (SELECT DISTINCT symbol_id FROM transactions WHERE {where})',
+              params)
+    names = dict(c.fetchall())
+    c.execute(f'''SELECT id, COALESCE(type, -1), COALESCE(symbol_id, -1), qty, price, com, day,
+                         COALESCE(currency, {CURRENCIES[BASE_CURRENCY]})
+                  FROM transactions WHERE {where} ORDER BY id''', params)
+    return TxColumns.from_coded(c, names)
+
+def get_tx_columns(user_id, symbols=None):
+    # Reads the stored codes and epoch days straight into arrays; symbols
+    # limits it to those symbols' trades.
+    with get_conn() as conn:
+        return _tx_columns(conn.cursor(), user_id, symbols)
+
+def get_summary_db(user_id, ledger_version, splits_key='{}'):
+    # Precomputed (sell_revenue, invested, realized_pnl), or None when it was
+    # computed for an older version of the ledger or other split factors.
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('''SELECT sell_revenue, invested, realized_pnl FROM user_summary
+                     WHERE user_id = ? AND ledger_version = ? AND splits = ?''',
+                  (user_id, ledger_version, splits_key))
+        return c.fetchone()
+
+def _save_summary(c, user_id, ledger_version, sell_revenue, invested, realized_pnl, splits_key):
+    c.execute('''INSERT OR REPLACE INTO user_summary(user_id, ledger_version, sell_revenue, invested, realized_pnl, splits, computed_at)
+                 VALUES (?,?,?,?,?,?,strftime('%s','now'))''',
+              (user_id, ledger_version, sell_revenue, invested, realized_pnl, splits_key))
+
+def save_summary_db(user_id, ledger_version, sell_revenue, invested, realized_pnl, splits_key='{}'):
+    write(_save_summary, user_id, ledger_version, sell_revenue, invested, realized_pnl, splits_key)
+
+def get_user_ids_db():
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT id FROM users ORDER BY id')
+        return [r[0] for r in c.fetchall()]
+
+def get_all_symbols_db():
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT symbol FROM symbols WHERE id IN (SELECT DISTINCT symbol_id FROM transactions WHERE type = ?)',
+                  (TYPE_CODES["BUY"],))
+        symbols = [r[0] for r in c.fetchall()]
+        c.execute("SELECT date(MIN(day) * 86400, 'unixepoch') FROM transactions")
+        start = c.fetchone()[0]
+    return symbols, start
+
+def get_all_currencies_db():
+    # Every currency some row is in or some user reports in.
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('''SELECT currency FROM transactions UNION SELECT currency FROM withdrawals
+                     UNION SELECT base_currency FROM users''')
+        return sorted({CURRENCY_NAMES[r[0]] for r in c.fetchall() if r[0] in CURRENCY_NAMES})
+
+def get_tx_currencies_db(user_id):
+    # Currency of each symbol's latest trade, which its position is kept in.
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('''SELECT s.symbol, t.currency FROM transactions t JOIN symbols s ON s.id = t.symbol_id
+                     WHERE t.id IN (SELECT MAX(id) FROM transactions WHERE user_id = ? GROUP BY symbol_id)''',
+                  (user_id,))
+        return {symbol: CURRENCY_NAMES.get(code, BASE_CURRENCY) for symbol, code in c.fetchall()}
+
+def get_base_currency_db(user_id):
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT base_currency FROM users WHERE id = ?', (user_id,))
+        row = c.fetchone()
+    return CURRENCY_NAMES.get(row[0], BASE_CURRENCY) if row else BASE_CURRENCY
+
+def _set_base_currency(c, user_id, currency):
+    c.execute('UPDATE users SET base_currency = ? WHERE id = ?', (currency_code(currency), user_id))
+    # Every stored figure is in the base currency, so the whole ledger counts as changed.
+    _bump_version(c, user_id, EPOCH.isoformat())
+
+def set_base_currency_db(user_id, currency):
+    write(_set_base_currency, user_id, currency)
+
+def get_benchmarks_db(user_id):
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT benchmarks FROM users WHERE id = ?', (user_id,))
+        row = c.fetchone()
+    if not row or row[0] is None: return list(DEFAULT_BENCHMARKS)
+    return [spec for spec in row[0].split(',') if spec]
+
+def get_all_benchmarks_db():
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT DISTINCT benchmarks FROM users WHERE benchmarks IS NOT NULL')
+        return sorted({spec for row in c.fetchall() for spec in row[0].split(',') if spec})
+
+def _set_benchmarks(c, user_id, specs):
+    # Benchmarks are not part of the stored NAV, so the ledger version stays.
+    c.execute('UPDATE users SET benchmarks = ? WHERE id = ?', (','.join(specs), user_id))
+
+def set_benchmarks_db(user_id, specs):
+    write(_set_benchmarks, user_id, list(specs))
+
+def get_holdings_db(user_id, splits=None):
+    # positions holds traded quantities; symbols in splits
+    # (price_store.split_factors) are replayed in today's shares instead.
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT symbol, qty, total_cost FROM positions WHERE user_id = ? AND qty > 0', (user_id,))
+        data = c.fetchall()
+    holdings = {symbol: {"qty": qty, "avg_cost": total_cost / qty} for symbol, qty, total_cost in data}
+    if splits:
+        from ledger import Ledger
+        for s in splits:
+            holdings.pop(s, None)
+        holdings.update(Ledger(get_tx_columns(user_id, list(splits)).adjusted(splits)).holdings())
+    return holdings
+
+def get_held_symbols_db(splits=None):
+    # Union across all users, for the background quote refresher. positions
+    # holds traded quantities, so symbols in splits (price_store.split_factors)
+    # are replayed per user in today's shares.
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT user_id, symbol, qty FROM positions')
+        held = set()
+        for user_id, symbol, qty in c.fetchall():
+            if splits and symbol in splits:
+                qty = _position_qty(c, user_id, symbol, splits)
+            if qty > QTY_EPSILON:
+                held.add(symbol)
+    return sorted(held)
+
+def get_position_qty_db(user_id, symbol, splits=None):
+    with get_conn() as conn:
+        return _position_qty(conn.cursor(), user_id, symbol, splits)
+
+def _delete_tx(c, tx_id):
+    c.execute(f'SELECT t.user_id, s.symbol, {DATE_SQL} FROM transactions t LEFT JOIN symbols s ON s.id = t.symbol_id WHERE t.id = ?',
+              (tx_id,))
+    row = c.fetchone()
+    c.execute('DELETE FROM transactions WHERE id = ?', (tx_id,))
+    rowcount = c.rowcount
+    if row and row[1]:
+        _rebuild_position(c, row[0], row[1])
+    if row:
+        _bump_version(c, row[0], row[2])
+    return rowcount
+
 def delete_tx_db(tx_id):
-    conn = sqlite3.connect(DB_NAME)
     try:
-        c = conn.cursor()
         safe_id = int(tx_id)
-        c.execute('DELETE FROM transactions WHERE id = ?', (safe_id,))
-        conn.commit()
-        print(f"DEBUG: Delete TX ID {safe_id} success. Rows affected: {c.rowcount}")
+        rowcount = write(_delete_tx, safe_id)
+        print(f"DEBUG: Delete TX ID {safe_id} success. Rows affected: {rowcount}")
     except Exception as e:
         print(f"ERROR deleting TX: {e}")
-    finally:
-        conn.close()
 
-def add_wd_db(user_id, amount, date):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('INSERT INTO withdrawals(user_id, amount, date) VALUES (?,?,?)', (user_id, amount, date))
-    conn.commit()
-    conn.close()
+def _add_wd(c, user_id, amount, date, currency=None):
+    if currency:
+        c.execute('INSERT INTO withdrawals(user_id, amount, day, currency) VALUES (?,?,?,?)',
+                  (user_id, amount, to_day(date), currency_code(currency)))
+    else:
+        c.execute('''INSERT INTO withdrawals(user_id, amount, day, currency)
+                     VALUES (?,?,?,(SELECT base_currency FROM users WHERE id = ?))''',
+                  (user_id, amount, to_day(date), user_id))
+    _bump_version(c, user_id, date)
+
+def add_wd_db(user_id, amount, date, currency=None):
+    # currency defaults to the user's base currency.
+    write(_add_wd, user_id, amount, date, currency)
 
 def get_wd_db(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT id, amount, date FROM withdrawals WHERE user_id = ?', (user_id,))
-    
-    data = c.fetchall()
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        c.execute(f'{WD_SELECT} WHERE t.user_id = ? ORDER BY t.id', (user_id,))
+        data = c.fetchall()
+
     result = []
     for row in data:
         r = dict(row)
@@ -100,17 +694,42 @@ def get_wd_db(user_id):
         result.append(r)
     return result
 
+def get_wd_page_db(user_id, before_id=None, limit=PAGE_SIZE, start=None, end=None):
+    where, params = _history_where(user_id, None, start, end, before_id)
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        c.execute(f'{WD_SELECT} WHERE {where} ORDER BY t.id DESC LIMIT ?', params + [limit])
+        return [dict(row, type='WITHDRAW') for row in c.fetchall()]
+
+def count_wd_db(user_id, start=None, end=None):
+    where, params = _history_where(user_id, None, start, end)
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(f'SELECT COUNT(*) FROM withdrawals t WHERE {where}', params)
+        return c.fetchone()[0]
+
+def get_wd_flows_db(user_id):
+    # Amount withdrawn per (date, currency), for conversion into the base currency.
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute(f'''SELECT {DATE_SQL}, {CURRENCY_SQL}, TOTAL(t.amount) FROM withdrawals t
+                      WHERE t.user_id = ? GROUP BY t.day, t.currency ORDER BY t.day''', (user_id,))
+        return c.fetchall()
+
+def _delete_wd(c, wd_id):
+    c.execute(f'SELECT t.user_id, {DATE_SQL} FROM withdrawals t WHERE t.id = ?', (wd_id,))
+    row = c.fetchone()
+    c.execute('DELETE FROM withdrawals WHERE id = ?', (wd_id,))
+    rowcount = c.rowcount
+    if row:
+        _bump_version(c, row[0], row[1])
+    return rowcount
+
 def delete_wd_db(wd_id):
-    conn = sqlite3.connect(DB_NAME)
     try:
-        c = conn.cursor()
         safe_id = int(wd_id)
-        
-        c.execute('DELETE FROM withdrawals WHERE id = ?', (safe_id,))
-        conn.commit()
-        print(f"DEBUG: Delete WD ID {safe_id} success. Rows affected: {c.rowcount}")
+        rowcount = write(_delete_wd, safe_id)
+        print(f"DEBUG: Delete WD ID {safe_id} success. Rows affected: {rowcount}")
     except Exception as e:
         print(f"ERROR deleting WD: {e}")
-    finally:
-        conn.close()
-
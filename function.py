@@ -1,14 +1,11 @@
 import datetime
+import numpy as np
 import pandas as pd
-import yfinance as yf
-import streamlit as st # เพิ่ม import นี้
-
-@st.cache_data(ttl=86400) 
-def fetch_sp500_data(start_date):
-    try:
-        return yf.download("^GSPC", start=start_date, progress=False)['Close']
-    except:
-        return pd.Series(dtype='float64')
+import fx
+import price_store
+from benchmarks import DEFAULT_BENCHMARKS, benchmark_label, benchmark_symbols, parse_benchmark
+from ledger import Ledger, apply_trade, as_ledger
+from tx_columns import TxColumns, split_multiplier
 
 def add_transactions(transactions, tx_type, symbol, qty, price, com, date=None):
     record_date = date if date else datetime.datetime.now().strftime("%Y-%m-%d")
@@ -28,91 +25,308 @@ def add_withdrawal(withdrawals, amount, date=None):
         "timestamp": date if date else datetime.datetime.now().strftime("%Y-%m-%d")
     })
 
-def get_holdings(transactions):
-    holdings = {}
-    for tx in transactions:
-        s = tx.get("symbol")
-        q = tx.get("qty", 0.0)
-        p = tx.get("price", 0.0)
-        c = tx.get("com", 0.0)
-        t_type = tx.get("type")
-
-        if s and t_type:
-            if s not in holdings:
-                holdings[s] = {"qty": 0.0, "total_cost": 0.0}
-
-            if t_type == "BUY":
-                holdings[s]["qty"] += q
-                holdings[s]["total_cost"] += q * p + c
-
-            elif t_type == "SELL":
-                if holdings[s]["qty"] > 0:
-                    avg = holdings[s]["total_cost"] / holdings[s]["qty"]
-                    holdings[s]["qty"] -= q
-                    holdings[s]["total_cost"] -= avg * q
-
-    return {
-        s: {
-            "qty": v["qty"],
-            "avg_cost": v["total_cost"] / v["qty"] if v["qty"] > 0 else 0
-        }
-        for s, v in holdings.items()
-        if v["qty"] > 0
-    }
+def get_holdings(transactions, splits=None):
+    # splits: price_store.split_factors, to report holdings in today's shares.
+    if splits:
+        if not isinstance(transactions, TxColumns):
+            transactions = TxColumns.from_records(as_ledger(transactions))
+        transactions = transactions.adjusted(splits)
+    return as_ledger(transactions).holdings()
+
+def fx_matrix(currencies, start, base):
+    # Value in `base` of one unit of each currency per day (dates x currencies),
+    # crossed through the shared USD series and filled across missing fixings.
+    currencies = list(dict.fromkeys(currencies))
+    usd = price_store.get_fx_rates(currencies + [base], start).sort_index().ffill().bfill()
+    missing = sorted(c for c in set(currencies) | {base} if usd[c].isna().all())
+    if missing:
+        raise fx.RatesUnavailable(f"Exchange rates unavailable for {', '.join(missing)}")
+    return usd[currencies].div(usd[base], axis=0)
+
+def row_rates(rates, dates, currencies):
+    # One rate per row: the last fixing on or before the row's date (the first
+    # fixing for earlier dates), gathered with a single fancy index.
+    pos = rates.index.searchsorted(pd.DatetimeIndex(dates), side='right') - 1
+    pos = np.clip(pos, 0, len(rates) - 1)
+    return rates.to_numpy()[pos, rates.columns.get_indexer(list(currencies))]
+
+def to_base(transactions, base):
+    # Ledger columns with prices, fees and amounts in `base` at each row's own
+    # date; returned unchanged when every row is already in `base`.
+    cols = transactions if isinstance(transactions, TxColumns) else TxColumns.from_records(as_ledger(transactions))
+    if not len(cols) or (cols.currency == fx.currency_code(base)).all(): return cols
+    currencies = cols.currency_array()
+    dates = cols.dates()
+    rates = fx_matrix(set(currencies), dates.min(), base)
+    return cols.converted(row_rates(rates, dates, currencies), base)
+
+def total_in_base(flows, base):
+    # flows: (date, currency, amount) rows, each converted at its date's rate.
+    flows = list(flows)
+    if all(currency == base for _, currency, _ in flows):
+        return float(sum(amount for _, _, amount in flows))
+    dates, currencies, amounts = zip(*flows)
+    rates = fx_matrix(set(currencies), min(dates), base)
+    return float((np.array(amounts, dtype=np.float64) * row_rates(rates, dates, currencies)).sum())
+
+def latest_rates(currencies, base):
+    # Most recent value in `base` of one unit of each currency.
+    currencies = set(currencies) | {base}
+    if currencies == {base}: return {base: 1.0}
+    rates = fx_matrix(currencies, datetime.date.today() - datetime.timedelta(days=10), base)
+    return rates.iloc[-1].to_dict()
 
 def calculate_port(transactions):
-    total_sell_revenue = 0.0
-    realized_pnl = 0.0
-    total_invested = 0.0
-    temp_holdings = {}
-
-    for tx in transactions:
-        t_type = tx.get("type") 
-        symbol = tx.get("symbol")
-        qty = tx.get("qty", 0.0)
-        price = tx.get("price", 0.0)
-        com = tx.get("com", 0.0)
-
-        if t_type == "BUY":
-            cost = (qty * price) + com
-            
-            
-            if symbol not in temp_holdings:
-                temp_holdings[symbol] = {"qty": 0.0, "total_cost": 0.0}
-            
-            temp_holdings[symbol]["qty"] += qty
-            temp_holdings[symbol]["total_cost"] += cost
-            
-        elif t_type == "SELL":
-            revenue = (qty * price) - com
-            total_sell_revenue += revenue
-
-            if symbol in temp_holdings and temp_holdings[symbol]["qty"] > 0:
-                avg_cost = temp_holdings[symbol]["total_cost"] / temp_holdings[symbol]["qty"]
-                cost_of_sold = avg_cost * qty
-
-                trade_pnl = revenue - cost_of_sold 
-                realized_pnl += trade_pnl
-
-                temp_holdings[symbol]["qty"] -= qty
-                temp_holdings[symbol]["total_cost"] -= cost_of_sold
-
-    for symbol, data in temp_holdings.items():
-        if data["qty"] > 0:
-            total_invested += data["total_cost"]
-
-    return total_sell_revenue, total_invested, realized_pnl
-
-@st.cache_data(ttl=3000) 
-def fetch_sp500_data(start_date):
+    ledger = as_ledger(transactions)
+    return ledger.sell_revenue, ledger.invested, ledger.realized_pnl
+
+def summary_in_base(transactions, base, splits=None):
+    # calculate_port in `base`, with positions in today's shares.
+    return calculate_port(Ledger(to_base(transactions, base).adjusted(splits)))
+
+def _replay_symbol(rows, qty=0.0, cost=0.0):
+    position = [qty, cost]
+    for t_type, q, p, c in rows:
+        apply_trade(position, t_type, q, p, c)
+    return position[0], position[1]
+
+def prepare_frame(df):
+    df = df.reset_index(drop=True)
+    df['pos'] = df.index
+    for col in ('symbol', 'qty', 'price', 'com', 'amount'):
+        if col not in df.columns: df[col] = None
+    for col in ('qty', 'price', 'com', 'amount'):
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+def adjust_splits(df, splits):
+    # Restates BUY/SELL rows in today's shares, one multiply per split symbol,
+    # so quantities line up with split-adjusted closes.
+    if not splits or df.empty: return df
+    days = df['date'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+    symbols = df['symbol'].to_numpy()
+    factor = np.ones(len(df))
+    for symbol, (split_days, factors) in splits.items():
+        rows = symbols == symbol
+        if rows.any():
+            factor[rows] = split_multiplier(days[rows], split_days, factors)
+    df['qty'] = df['qty'] * factor
+    df['price'] = df['price'] / factor
+    return df
+
+def prices_in_base(data, base, symbols, rates=None):
+    # Restates the `symbols` columns of a price matrix in `base`, each times
+    # its quote currency's daily rate gathered by column index.
+    symbols = [s for s in symbols if s in data.columns]
+    quote = np.array([fx.symbol_currency(s) for s in symbols], dtype=object)
+    if set(quote) <= {base}: return data
+    if rates is None:
+        rates = fx_matrix(set(quote), data.index.min(), base)
+    daily = rates.reindex(data.index, method='ffill').bfill()
+    data = data.copy()
+    data[symbols] = data[symbols].to_numpy() * daily.to_numpy()[:, daily.columns.get_indexer(quote)]
+    return data
+
+def history_in_base(df, data, base, symbols=None):
+    # Restates trade rows in `base` at their own date's rate, and the price
+    # matrix through prices_in_base. Only `symbols` (default: the traded
+    # ones) are converted; benchmark columns stay in their own currency.
+    if symbols is None:
+        symbols = list(df['symbol'].dropna().unique()) if 'symbol' in df.columns else []
+    symbols = [s for s in symbols if s in data.columns]
+    quote = {fx.symbol_currency(s) for s in symbols}
+    row_currency = df['currency'].fillna(base) if 'currency' in df.columns else pd.Series(base, index=df.index)
+    currencies = set(row_currency) | quote
+    if currencies <= {base}: return df, data
+
+    start = min(df['date'].min(), data.index.min()) if not df.empty else data.index.min()
+    rates = fx_matrix(currencies, start, base)
+    if not df.empty:
+        r = row_rates(rates, df['date'], row_currency)
+        for col in ('price', 'com', 'amount'):
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce') * r
+    df['currency'] = base
+    return df, prices_in_base(data, base, symbols, rates)
+
+def symbol_states(df, initial=None):
+    # Holdings only change on transaction dates, so the per-symbol state is
+    # computed once per distinct date. The state on a date is the ledger-order
+    # replay of every transaction dated on or before it; back-dated rows force
+    # a replay of that symbol only. `initial` seeds symbols with a
+    # (date, qty, cost) checkpoint when df only holds rows that come after it
+    # in ledger order.
+    initial = initial or {}
+    qty_states = {}
+    cost_states = {}
+    trades = df[df['type'].isin(['BUY', 'SELL']) & df['symbol'].notna() & (df['symbol'] != '')]
+    groups = dict(list(trades.groupby('symbol', sort=False)))
+    for symbol in list(initial) + [s for s in groups if s not in initial]:
+        dates, qtys, costs = [], [], []
+        q0, c0 = 0.0, 0.0
+        if symbol in initial:
+            date, q0, c0 = initial[symbol]
+            dates.append(date)
+            qtys.append(q0)
+            costs.append(c0)
+
+        q, c = q0, c0
+        df_sym = groups[symbol].sort_values(['date', 'pos']) if symbol in groups else trades.iloc[:0]
+        rows = list(zip(df_sym['date'], df_sym['pos'], df_sym['type'], df_sym['qty'], df_sym['price'], df_sym['com']))
+        seen = []
+        last_pos = -1
+        i = 0
+        while i < len(rows):
+            date = rows[i][0]
+            j = i
+            while j < len(rows) and rows[j][0] == date: j += 1
+            group = rows[i:j]
+            if group[0][1] > last_pos:
+                q, c = _replay_symbol([r[2:] for r in group], q, c)
+                seen.extend(group)
+            else:
+                seen.extend(group)
+                seen.sort(key=lambda r: r[1])
+                q, c = _replay_symbol([r[2:] for r in seen], q0, c0)
+            last_pos = max(last_pos, group[-1][1])
+            dates.append(date)
+            qtys.append(q)
+            costs.append(c)
+            i = j
+        qty_states[symbol] = pd.Series(qtys, index=dates)
+        cost_states[symbol] = pd.Series(costs, index=dates)
+    return qty_states, cost_states
+
+def as_of(states, index):
+    if not states: return pd.DataFrame(index=index)
+    wide = pd.DataFrame(states).sort_index().ffill()
+    return wide.reindex(index, method='ffill').fillna(0.0)
+
+def cash_series(df, index, cash0=0.0):
+    sells = df['type'] == 'SELL'
+    flows = ((df['qty'] * df['price']) - df['com']).where(sells, 0.0)
+    flows = flows - df['amount'].where(df['type'] == 'WITHDRAW', 0.0)
+    cash = flows.groupby(df['date']).sum().sort_index().cumsum() + cash0
+    return cash.reindex(index, method='ffill').fillna(cash0)
+
+def flow_series(df, index):
+    # Money entering (+) or leaving (-) the account per day: buys are paid in
+    # from outside, withdrawals are paid out. Rows dated between bars count
+    # on the next bar, as they do in cash_series.
+    flows = ((df['qty'] * df['price']) + df['com']).where(df['type'] == 'BUY', 0.0)
+    flows = flows - df['amount'].where(df['type'] == 'WITHDRAW', 0.0)
+    total = flows.groupby(df['date']).sum().sort_index().cumsum()
+    cum = total.reindex(index, method='ffill').fillna(0.0)
+    return cum.diff().fillna(cum.iloc[0]) if len(cum) else cum
+
+def position_states(df_tx, index):
+    df = prepare_frame(df_tx)
+    qty_states, cost_states = symbol_states(df)
+    return as_of(qty_states, index), as_of(cost_states, index), cash_series(df, index)
+
+def price_matrix(symbols, start_date, benchmarks=()):
+    # Holdings and every benchmark component come from one get_closes call,
+    # so they are downloaded in the same batch and share the price cache.
+    # Rows are the holdings' trading days whichever benchmarks are chosen;
+    # benchmark closes are carried onto them.
+    wanted = list(dict.fromkeys(list(symbols) + benchmark_symbols(benchmarks)))
+    if not wanted: return pd.DataFrame()
     try:
-        return yf.download("^GSPC", start=start_date, progress=False)['Close']
+        data = price_store.get_closes(wanted, start_date)
     except:
-        return pd.Series(dtype='float64')
-
-def port_history(transactions):
-    if not transactions: return pd.DataFrame()
-    df_tx = pd.DataFrame(transactions)
+        return pd.DataFrame()
+    held = [s for s in symbols if s in data.columns]
+    extra = [s for s in data.columns if s not in held]
+    if held and extra:
+        data[extra] = data[extra].ffill()
+        data = data[data[held].notna().any(axis=1)]
+    return data
+
+def portfolio_nav(qty, cost, cash, data):
+    prices = data.reindex(columns=qty.columns).fillna(0.0)
+    held = qty > 0
+    stock_value = (qty.where(held, 0.0) * prices).sum(axis=1)
+    current_invested = cost.where(held, 0.0).sum(axis=1)
+
+    net_worth = stock_value + cash
+    roi = ((net_worth - current_invested) / current_invested * 100).where(current_invested > 0, 0.0)
+
+    df_nav = pd.DataFrame({'stock_value': stock_value, 'cash': cash, 'invested': current_invested,
+                           'My Portfolio (%)': roi})
+    df_nav.index.name = 'Date'
+    return df_nav
+
+def benchmark_returns(closes, specs):
+    # Percent return of each spec since the first row of `closes`. Every
+    # component is rebased to its first valid close in one divide, and the
+    # mixes come out of one (dates x components) @ (components x specs)
+    # product; a spec is NaN until all of its components have a close.
+    weights = [parse_benchmark(spec) for spec in specs]
+    symbols = list(dict.fromkeys(s for w in weights for s in w))
+    values = closes.reindex(columns=symbols).ffill().to_numpy(dtype=np.float64)
+    if not len(values): return pd.DataFrame(index=closes.index)
+    first = values[np.argmax(~np.isnan(values), axis=0), np.arange(len(symbols))]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel = values / np.where(first > 0, first, np.nan) - 1.0
+    w = np.array([[wt.get(s, 0.0) for wt in weights] for s in symbols])
+    missing = np.isnan(rel).astype(np.float64) @ (w > 0)
+    mixed = np.where(missing > 0, np.nan, np.nan_to_num(rel) @ w) * 100
+    return pd.DataFrame(mixed, index=closes.index, columns=[f"{benchmark_label(s)} (%)" for s in specs])
+
+def add_benchmarks(df_result, closes, specs):
+    # closes start on the portfolio's first day, so windows that start later
+    # are still measured from there.
+    if not specs or closes.empty: return df_result
+    returns = benchmark_returns(closes, specs).reindex(df_result.index, method='ffill')
+    for col in returns.columns:
+        df_result[col] = returns[col]
+    return df_result
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: indices of n_out points that keep the
+    # visual shape of (x, y). Always keeps the first and last point.
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    picked = np.empty(n_out, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        picked[i + 1] = a
+    return picked
+
+def downsample(df, points):
+    # Union of the LTTB picks of every column, so each line keeps its shape.
+    if len(df) <= points or df.empty: return df
+    per_column = max(3, points // len(df.columns))
+    x = df.index.asi8.astype(np.float64)
+    keep = set()
+    for col in df.columns:
+        valid = np.flatnonzero(df[col].notna().to_numpy())
+        y = df[col].to_numpy(dtype=np.float64)[valid]
+        keep.update(valid[lttb(x[valid], y, per_column)].tolist())
+    return df.iloc[sorted(keep)]
+
+def port_history(transactions, withdrawals=(), base=fx.BASE_CURRENCY, benchmarks=DEFAULT_BENCHMARKS):
+    ledger = as_ledger(transactions)
+    if not ledger: return pd.DataFrame()
+    df_tx = ledger.frame()
+    if 'currency' not in df_tx.columns:
+        df_tx['currency'] = None
+    df_tx['currency'] = [c or fx.symbol_currency(s) for c, s in zip(df_tx['currency'], df_tx['symbol'])]
+    if withdrawals:
+        df_wd = pd.DataFrame([{"type": "WITHDRAW", "amount": w["amount"], "date": w.get("date", w.get("timestamp")),
+                               "currency": w.get("currency") or base}
+                              for w in withdrawals])
+        df_tx = pd.concat([df_tx, df_wd], ignore_index=True)
 
     if 'date' not in df_tx.columns:
         df_tx['date'] = datetime.datetime.now().strftime("%Y-%m-%d")
@@ -124,95 +338,16 @@ def port_history(transactions):
 
     start_date = df_tx["date"].min()
 
-    symbols = list(set(t['symbol'] for t in transactions if t.get('symbol')))
-    symbols = [s for s in symbols if s] 
-    
-    sp500_data = fetch_sp500_data(start_date)
+    data = price_matrix(ledger.symbols, start_date, benchmarks)
+    if data.empty: return pd.DataFrame()
 
-    try:
-        if not symbols:
-             data = pd.DataFrame()
-        else:
-             data = yf.download(symbols, start=start_date, progress=False)['Close']
-    except:
-        return pd.DataFrame()
+    df_tx = adjust_splits(df_tx, price_store.split_factors(ledger.symbols))
+    df_tx, data = history_in_base(df_tx, data, base, ledger.symbols)
+    qty, cost, cash = position_states(df_tx, data.index)
 
-    if not sp500_data.empty:
-        if isinstance(data, pd.Series): data = data.to_frame()
-        if not data.empty:
-             if isinstance(sp500_data, pd.Series): sp500_data = sp500_data.to_frame(name="^GSPC")
-             combined_data = data.join(sp500_data, how='outer')
-             data = combined_data
-        else:
-             data = sp500_data.to_frame(name="^GSPC")
+    df_result = portfolio_nav(qty, cost, cash, data)[['My Portfolio (%)']]
+    if df_result.empty: return pd.DataFrame()
 
-    if data.empty: return pd.DataFrame()
-    
-    if isinstance(data.columns, pd.MultiIndex):
-        data.columns = data.columns.get_level_values(0)
-    
-    daily_value = []
-    
-    for date in data.index:
-        current_txs = df_tx[df_tx["date"] <= date].to_dict('records')
-        cash_cow = 0.0
-        temp_hold = {}
-
-        for tx in current_txs:
-            symbol = tx.get("symbol")
-            qty = tx.get("qty", 0.0)
-            price = tx.get("price", 0.0)
-            com = tx.get("com", 0.0)
-            t_type = tx.get("type")
-
-            if t_type == "BUY":
-                cost = (qty * price) + com
-                if symbol not in temp_hold: temp_hold[symbol] = {"qty": 0.0, "cost": 0.0}
-                temp_hold[symbol]["qty"] += qty
-                temp_hold[symbol]["cost"] += cost
-            
-            elif t_type == "SELL":
-                revenue = (qty * price) - com
-                cash_cow += revenue
-                if symbol in temp_hold and temp_hold[symbol]["qty"] > 0:
-                    avg_cost = temp_hold[symbol]["cost"] / temp_hold[symbol]["qty"]
-                    cost_of_sold = avg_cost * qty
-                    temp_hold[symbol]["qty"] -= qty
-                    temp_hold[symbol]["cost"] -= cost_of_sold
-            
-            elif t_type == "WITHDRAW":
-                cash_cow -= tx.get("amount", 0.0)
-        
-        stock_value = 0.0
-        current_invested = 0.0
-
-        for s, info in temp_hold.items():
-            if info['qty'] > 0:
-                if s in data.columns:
-                    val = data.loc[date, s]
-                    price = val if not pd.isna(val) else 0.0
-                else: price = 0.0
-                
-                stock_value += info['qty'] * price
-                current_invested += info['cost']
-
-        net_worth = stock_value + cash_cow
-        roi = ((net_worth - current_invested) / current_invested * 100) if current_invested > 0 else 0.0
-
-        daily_value.append({
-            'Date': date,
-            'My Portfolio (%)': roi
-        })
-
-    if not daily_value: return pd.DataFrame()
-
-    df_result = pd.DataFrame(daily_value).set_index('Date')
-
-    if '^GSPC' in data.columns:
-        valid_sp = data['^GSPC'].dropna()
-        if not valid_sp.empty:
-            start_val = valid_sp.iloc[0]
-            if start_val > 0:
-                 df_result['S&P 500 (%)'] = ((data['^GSPC'] - start_val) / start_val) * 100
-
-    return df_result
\ No newline at end of file
+    add_benchmarks(df_result, data, benchmarks)
+
+    return df_result
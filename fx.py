@@ -0,0 +1,46 @@
+# Currency metadata. Amounts are stored with their ISO 4217 numeric code;
+# the rest of the app works with the letter codes. A symbol's quote currency
+# follows its exchange suffix (no suffix: USD).
+
+BASE_CURRENCY = "USD"
+
+CURRENCIES = {
+    "USD": 840, "THB": 764, "EUR": 978, "GBP": 826, "JPY": 392, "CHF": 756,
+    "HKD": 344, "SGD": 702, "CAD": 124, "AUD": 36, "CNY": 156, "SEK": 752,
+    "DKK": 208, "NOK": 578,
+}
+CURRENCY_NAMES = {code: name for name, code in CURRENCIES.items()}
+
+SUFFIX_CURRENCY = {
+    ".BK": "THB",
+    ".PA": "EUR", ".DE": "EUR", ".F": "EUR", ".AS": "EUR", ".BR": "EUR", ".MI": "EUR",
+    ".MC": "EUR", ".LS": "EUR", ".HE": "EUR", ".VI": "EUR", ".IR": "EUR",
+    ".L": "GBP", ".SW": "CHF", ".T": "JPY", ".HK": "HKD", ".SI": "SGD",
+    ".TO": "CAD", ".V": "CAD", ".AX": "AUD", ".SS": "CNY", ".SZ": "CNY",
+    ".ST": "SEK", ".CO": "DKK", ".OL": "NOK",
+}
+
+SIGNS = {"USD": "$", "THB": "฿", "EUR": "€", "GBP": "£", "JPY": "¥"}
+
+
+class RatesUnavailable(Exception):
+    # Raised instead of converting with NaN when a currency has no fixing at
+    # all, so nothing computed from it gets stored.
+    pass
+
+
+def symbol_currency(symbol):
+    if isinstance(symbol, str) and "." in symbol:
+        return SUFFIX_CURRENCY.get(symbol[symbol.rindex("."):].upper(), BASE_CURRENCY)
+    return BASE_CURRENCY
+
+def currency_code(currency):
+    return CURRENCIES.get(currency, CURRENCIES[BASE_CURRENCY])
+
+def fx_symbol(currency):
+    # Market-data ticker quoting USD per unit of `currency`.
+    return f"{currency}USD=X"
+
+def money(amount, currency):
+    sign = SIGNS.get(currency)
+    return f"{sign}{amount:,.2f}" if sign else f"{currency} {amount:,.2f}"
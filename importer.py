@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+from fx import CURRENCIES, symbol_currency
+from ledger import Ledger, as_ledger
+from tx_columns import TxColumns, split_multiplier
+
+# Header spellings seen in common broker exports, mapped onto ledger fields.
+COLUMN_ALIASES = {
+    "type": ["type", "action", "side", "buy/sell", "transaction type", "trade type"],
+    "symbol": ["symbol", "ticker", "instrument", "security", "code"],
+    "qty": ["qty", "quantity", "shares", "units", "volume", "filled qty"],
+    "price": ["price", "trade price", "fill price", "avg price", "execution price"],
+    "com": ["com", "commission", "commissions", "fee", "fees", "comm/fee"],
+    "date": ["date", "trade date", "time", "date/time", "datetime", "execution time"],
+    "currency": ["currency", "ccy", "curr", "currency code"],
+}
+
+TYPE_ALIASES = {
+    "BUY": "BUY", "B": "BUY", "BOT": "BUY", "BOUGHT": "BUY",
+    "SELL": "SELL", "S": "SELL", "SLD": "SELL", "SOLD": "SELL",
+}
+
+def parse_csv(file):
+    df = pd.read_csv(file, skipinitialspace=True)
+    columns = {c.strip().lower(): c for c in df.columns}
+
+    data = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        source = next((columns[a] for a in aliases if a in columns), None)
+        if source is None:
+            if field == "com":
+                data[field] = 0.0
+                continue
+            if field == "currency":
+                data[field] = None
+                continue
+            raise ValueError(f"Missing column for '{field}' (expected one of: {', '.join(aliases)})")
+        data[field] = df[source]
+
+    out = pd.DataFrame(data, index=df.index)
+    out["type"] = out["type"].astype(str).str.strip().str.upper().map(TYPE_ALIASES)
+    out["symbol"] = out["symbol"].fillna("").astype(str).str.strip().str.upper()
+    # Without a currency column a trade is in its listing's currency.
+    currency = out["currency"].fillna("").astype(str).str.strip().str.upper()
+    out["currency"] = [c or symbol_currency(s) for c, s in zip(currency, out["symbol"])]
+    for col in ("qty", "price", "com"):
+        out[col] = pd.to_numeric(out[col].astype(str).str.replace(r"[$,\s]", "", regex=True), errors="coerce")
+    # Some brokers sign quantities and fees by direction.
+    out["qty"] = out["qty"].abs()
+    out["com"] = out["com"].fillna(0.0).abs()
+    try:
+        dates = pd.to_datetime(out["date"])
+    except (ValueError, TypeError):
+        dates = pd.to_datetime(out["date"], errors="coerce", format="mixed")
+    out["row"] = df.index + 2
+
+    # Statements are often newest-first; the ledger is replayed oldest-first.
+    # Sort on the full timestamp so same-day fills keep their time order, and
+    # break remaining ties in the direction the statement runs.
+    valid = dates.dropna()
+    newest_first = len(valid) > 1 and valid.is_monotonic_decreasing and not valid.is_monotonic_increasing
+    out["ts"] = dates
+    out["order"] = -out["row"] if newest_first else out["row"]
+    out = out.sort_values(["ts", "order"], kind="stable", na_position="first")
+    out["date"] = out["ts"].dt.strftime("%Y-%m-%d")
+    fields = ["type", "symbol", "qty", "price", "com", "date", "currency", "row"]
+    return [dict(zip(fields, values)) for values in zip(*(out[f].tolist() for f in fields))]
+
+def _in_todays_shares(r, splits):
+    if r["symbol"] not in splits: return r
+    m = float(split_multiplier(np.datetime64(r["date"], 'D').astype(np.int64), *splits[r["symbol"]]))
+    return {**r, "qty": r["qty"] * m, "price": r["price"] / m}
+
+def validate_import(transactions, rows, splits=None):
+    # One pass over the existing ledger followed by the new rows, applying the
+    # same checks the sidebar form does for a single trade. splits
+    # (price_store.split_factors) puts both in today's shares.
+    splits = splits or {}
+    if splits and not isinstance(transactions, TxColumns):
+        transactions = TxColumns.from_records(as_ledger(transactions))
+    ledger = Ledger(transactions.adjusted(splits) if splits else transactions)
+    # Currency each open position is held in: that of its latest trade.
+    if isinstance(transactions, TxColumns):
+        pairs = zip(transactions.symbol_array(), transactions.currency_array())
+    else:
+        pairs = ((t.get("symbol"), t.get("currency")) for t in ledger)
+    held_in = {s: c for s, c in pairs if s and c}
+    errors = []
+    for r in rows:
+        if pd.isna(r["type"]):
+            errors.append(f"Row {r['row']}: unknown action")
+        elif not r["symbol"] or pd.isna(r["qty"]) or r["qty"] <= 0 or pd.isna(r["price"]) or r["price"] <= 0:
+            errors.append(f"Row {r['row']}: invalid input")
+        elif pd.isna(r["date"]):
+            errors.append(f"Row {r['row']}: invalid date")
+        elif r["currency"] not in CURRENCIES:
+            errors.append(f"Row {r['row']}: unknown currency {r['currency']}")
+        elif ledger.qty(r["symbol"]) > 0 and held_in.get(r["symbol"], r["currency"]) != r["currency"]:
+            errors.append(f"Row {r['row']}: {r['symbol']} is held in {held_in[r['symbol']]}, not {r['currency']}")
+        else:
+            trade = _in_todays_shares(r, splits)
+            if r["type"] == "SELL" and trade["qty"] > ledger.qty(r["symbol"]):
+                errors.append(f"Row {r['row']}: not enough shares of {r['symbol']}")
+            else:
+                ledger.apply(trade)
+                held_in[r["symbol"]] = r["currency"]
+    return errors
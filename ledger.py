@@ -0,0 +1,144 @@
+from enum import IntEnum
+
+
+class TxType(IntEnum):
+    # Stored in transactions.type; the names are what the rest of the app uses.
+    BUY = 0
+    SELL = 1
+    WITHDRAW = 2
+
+
+TYPE_CODES = {t.name: t.value for t in TxType}
+TYPE_NAMES = [t.name for t in TxType]
+
+
+def apply_trade(position, t_type, qty, price, com):
+    # Average-cost bookkeeping for one BUY/SELL on a [qty, total_cost] pair.
+    # Returns the realized P&L of the trade (0.0 for buys and unmatched sells).
+    if t_type == "BUY":
+        position[0] += qty
+        position[1] += (qty * price) + com
+    elif t_type == "SELL":
+        if position[0] > 0:
+            avg_cost = position[1] / position[0]
+            cost_of_sold = avg_cost * qty
+            position[0] -= qty
+            position[1] -= cost_of_sold
+            return ((qty * price) - com) - cost_of_sold
+    return 0.0
+
+
+class Ledger:
+    def __init__(self, transactions=()):
+        self.positions = {}
+        self.sell_revenue = 0.0
+        self.realized_pnl = 0.0
+        self.withdrawn = 0.0
+        self._frame = None
+
+        from tx_columns import TxColumns
+        if isinstance(transactions, TxColumns):
+            self.transactions = transactions
+            self._apply_columns(transactions)
+        else:
+            self.transactions = list(transactions)
+            for tx in self.transactions:
+                self.apply(tx)
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __iter__(self):
+        return iter(self.transactions)
+
+    def apply(self, tx):
+        t_type = tx.get("type")
+        symbol = tx.get("symbol")
+        qty = tx.get("qty", 0.0)
+        price = tx.get("price", 0.0)
+        com = tx.get("com", 0.0)
+
+        if t_type == "SELL":
+            self.sell_revenue += (qty * price) - com
+        elif t_type == "WITHDRAW":
+            self.withdrawn += tx.get("amount", 0.0)
+
+        if symbol and t_type in ("BUY", "SELL"):
+            if symbol not in self.positions:
+                if t_type == "SELL": return
+                self.positions[symbol] = [0.0, 0.0, 0.0]
+            position = self.positions[symbol]
+            pnl = apply_trade(position, t_type, qty, price, com)
+            position[2] += pnl
+            self.realized_pnl += pnl
+
+    def _apply_columns(self, cols):
+        # Same bookkeeping as apply(), reading the arrays directly instead of
+        # materializing a dict per row.
+        buy, sell, withdraw = TxType.BUY, TxType.SELL, TxType.WITHDRAW
+        symbols = cols.symbols
+        positions = self.positions
+        for t_type, code, qty, price, com, amount in zip(cols.types.tolist(), cols.codes.tolist(), cols.qty.tolist(),
+                                                         cols.price.tolist(), cols.com.tolist(), cols.amount.tolist()):
+            if t_type == sell:
+                self.sell_revenue += (qty * price) - com
+            elif t_type == withdraw:
+                self.withdrawn += amount
+                continue
+            elif t_type != buy:
+                continue
+            if code < 0:
+                continue
+
+            symbol = symbols[code]
+            position = positions.get(symbol)
+            if position is None:
+                if t_type == sell: continue
+                position = positions[symbol] = [0.0, 0.0, 0.0]
+            pnl = apply_trade(position, "BUY" if t_type == buy else "SELL", qty, price, com)
+            position[2] += pnl
+            self.realized_pnl += pnl
+
+    @property
+    def cash(self):
+        return self.sell_revenue - self.withdrawn
+
+    @property
+    def invested(self):
+        return sum(p[1] for p in self.positions.values() if p[0] > 0)
+
+    @property
+    def symbols(self):
+        return list(self.positions.keys())
+
+    def qty(self, symbol):
+        position = self.positions.get(symbol)
+        return position[0] if position else 0.0
+
+    def avg_cost(self, symbol):
+        position = self.positions.get(symbol)
+        return position[1] / position[0] if position and position[0] > 0 else 0
+
+    def holdings(self):
+        return {
+            s: {"qty": p[0], "avg_cost": p[1] / p[0]}
+            for s, p in self.positions.items()
+            if p[0] > 0
+        }
+
+    def frame(self):
+        # Built once per ledger and shared by every history view.
+        if self._frame is None:
+            from tx_columns import TxColumns
+            if isinstance(self.transactions, TxColumns):
+                self._frame = self.transactions.to_frame(parse_dates=True)
+            else:
+                import pandas as pd
+                self._frame = pd.DataFrame(self.transactions)
+        return self._frame.copy()
+
+
+def as_ledger(transactions):
+    if isinstance(transactions, Ledger):
+        return transactions
+    return Ledger(transactions)
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+# Selected with PORTFOLIO_MARKET_DATA=yfinance|local. The local backend replays
+# <PORTFOLIO_MARKET_DATA_DIR>/<SYMBOL>.csv (Date,Close) when such a file exists
+# and otherwise generates a seeded random walk, so runs are repeatable offline.
+# Corporate actions come from <SYMBOL>.actions.csv (Date,Split,Dividend).
+PROVIDER_ENV = "PORTFOLIO_MARKET_DATA"
+DATA_DIR_ENV = "PORTFOLIO_MARKET_DATA_DIR"
+
+# Rough USD per unit that the local backend's <CCY>USD=X walks end at.
+FX_LEVELS = {
+    "THB": 0.028, "EUR": 1.08, "GBP": 1.27, "JPY": 0.0067, "CHF": 1.12, "HKD": 0.128, "SGD": 0.74,
+    "CAD": 0.73, "AUD": 0.66, "CNY": 0.138, "SEK": 0.095, "DKK": 0.145, "NOK": 0.093,
+}
+
+
+class MarketDataProvider:
+    name = None
+
+    def history(self, symbols, start, end=None):
+        # Daily closes, one column per symbol, indexed by 'Date'; end is exclusive.
+        raise NotImplementedError
+
+    def last_price(self, symbol):
+        raise NotImplementedError
+
+    def actions(self, symbol):
+        # Splits (new shares per old share) and cash dividends per share,
+        # indexed by ex-date; 0 where a day has only the other kind.
+        return pd.DataFrame({'split': [], 'dividend': []}, index=pd.DatetimeIndex([], name='Date'))
+
+
+class YFinanceProvider(MarketDataProvider):
+    name = "yfinance"
+
+    def history(self, symbols, start, end=None):
+        import yfinance as yf
+        data = yf.download(symbols, start=start, end=end, progress=False)['Close']
+        if isinstance(data, pd.Series):
+            data = data.to_frame(name=symbols[0])
+        if isinstance(data.columns, pd.MultiIndex):
+            data.columns = data.columns.get_level_values(-1)
+        return data
+
+    def last_price(self, symbol):
+        import yfinance as yf
+        return yf.Ticker(symbol).fast_info["last_price"]
+
+    def actions(self, symbol):
+        import yfinance as yf
+        data = yf.Ticker(symbol).actions
+        if data is None or data.empty:
+            return super().actions(symbol)
+        data = data.reindex(columns=['Stock Splits', 'Dividends'], fill_value=0.0)
+        data.columns = ['split', 'dividend']
+        index = data.index.tz_localize(None) if data.index.tz is not None else data.index
+        data.index = pd.DatetimeIndex(index.normalize(), name='Date')
+        return data
+
+
+class LocalProvider(MarketDataProvider):
+    name = "local"
+    EPOCH = "2000-01-03"
+
+    def __init__(self, data_dir=None, seed=0):
+        self.data_dir = data_dir
+        self.seed = seed
+        self._series = {}
+
+    def _load(self, symbol):
+        if symbol in self._series:
+            return self._series[symbol]
+
+        path = os.path.join(self.data_dir, f"{symbol}.csv") if self.data_dir else None
+        if path and os.path.exists(path):
+            df = pd.read_csv(path, parse_dates=['Date'])
+            series = df.set_index('Date')['Close'].sort_index()
+        else:
+            index = pd.date_range(self.EPOCH, pd.Timestamp.today().normalize(), freq='D', name='Date')
+            index = index[index.dayofweek < 5]
+            digest = hashlib.sha256(f"{self.seed}:{symbol}".encode()).digest()
+            rng = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+            currency = symbol[:-len("USD=X")] if symbol.endswith("USD=X") else None
+            if currency:
+                # FX pairs wander a little and end near their currency's level.
+                vol = rng.uniform(0.002, 0.005)
+                walk = np.cumsum(rng.normal(0.0, vol, len(index)))
+                series = pd.Series(FX_LEVELS.get(currency, 1.0) * np.exp(walk - walk[-1]), index=index)
+            else:
+                drift = rng.uniform(-0.0001, 0.0004)
+                vol = rng.uniform(0.008, 0.025)
+                start = rng.uniform(10, 500)
+                log_returns = rng.normal(drift - vol ** 2 / 2, vol, len(index))
+                series = pd.Series(start * np.exp(np.cumsum(log_returns)), index=index)
+
+        self._series[symbol] = series
+        return series
+
+    def history(self, symbols, start, end=None):
+        data = pd.DataFrame({s: self._load(s) for s in symbols})
+        mask = data.index >= pd.Timestamp(start)
+        if end is not None:
+            mask &= data.index < pd.Timestamp(end)
+        data = data[mask]
+        data.index.name = 'Date'
+        return data
+
+    def last_price(self, symbol):
+        series = self._load(symbol)
+        series = series[series.index <= pd.Timestamp.today()]
+        return float(series.iloc[-1]) if not series.empty else 0.0
+
+    def actions(self, symbol):
+        path = os.path.join(self.data_dir, f"{symbol}.actions.csv") if self.data_dir else None
+        if not path or not os.path.exists(path):
+            return super().actions(symbol)
+        df = pd.read_csv(path, parse_dates=['Date']).set_index('Date').sort_index()
+        return pd.DataFrame({'split': df.get('Split', 0.0), 'dividend': df.get('Dividend', 0.0)},
+                            index=df.index).fillna(0.0)
+
+
+_provider = None
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        if os.environ.get(PROVIDER_ENV, "yfinance") == "local":
+            _provider = LocalProvider(os.environ.get(DATA_DIR_ENV))
+        else:
+            _provider = YFinanceProvider()
+    return _provider
+
+def set_provider(provider):
+    global _provider
+    _provider = provider
@@ -0,0 +1,238 @@
+import json
+import pandas as pd
+import streamlit as st
+import database as db
+import perf
+import price_store
+from benchmarks import benchmark_symbols
+from ledger import TxType
+from risk import RiskAccumulator, xirr, to_date
+from function import (prepare_frame, adjust_splits, history_in_base, total_in_base, symbol_states, as_of,
+                      cash_series, flow_series, price_matrix, portfolio_nav, add_benchmarks,
+                      downsample)
+
+# The daily NAV series is persisted per user in nav_history, together with the
+# per-symbol position after every transaction date (nav_checkpoints). Ledger
+# writes record the earliest date they touch in nav_dirty, and refresh_nav
+# only recomputes from there (or from the last stored day, whose bar may
+# still be moving). Quantities are restated in today's shares; a change in
+# a symbol's split factors (nav_splits) recomputes the whole series. Values
+# are in the user's base currency, whose change bumps the ledger version.
+
+TX_COLUMNS = ['id', 'type', 'symbol', 'qty', 'price', 'com', 'day', 'currency']
+TX_SELECT = (f"SELECT t.id, {db.TYPE_SQL}, s.symbol, t.qty, t.price, t.com, t.day, {db.CURRENCY_SQL} "
+             "FROM transactions t LEFT JOIN symbols s ON s.id = t.symbol_id")
+
+# Points per chart; longer windows are reduced with LTTB before rendering.
+CHART_POINTS = 500
+
+def _fetch_frame(c, sql, params):
+    c.execute(sql, params)
+    return pd.DataFrame(c.fetchall(), columns=TX_COLUMNS)
+
+def _clear(c, user_id):
+    for table in ('nav_history', 'nav_checkpoints', 'nav_dirty', 'risk_state', 'nav_splits'):
+        c.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+
+def refresh_nav(user_id):
+    with db.get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT version FROM ledger_versions WHERE user_id = ?', (user_id,))
+        row = c.fetchone()
+        version = row[0] if row else 0
+
+        c.execute('SELECT MIN(day) FROM transactions WHERE user_id = ?', (user_id,))
+        start = c.fetchone()[0]
+        if start is None:
+            db.write(_clear, user_id)
+            return
+        start = db.from_day(start)
+
+        c.execute('SELECT symbol FROM symbols WHERE id IN (SELECT DISTINCT symbol_id FROM transactions WHERE user_id = ? AND type = ?)',
+                  (user_id, TxType.BUY))
+        symbols = [r[0] for r in c.fetchall()]
+        price_store.refresh_actions(symbols)
+        splits = price_store.split_factors(symbols)
+        signature = price_store.splits_signature(splits)
+
+        c.execute('SELECT MIN(date), MAX(date) FROM nav_history WHERE user_id = ?', (user_id,))
+        first_nav, last_nav = c.fetchone()
+        c.execute('SELECT from_date FROM nav_dirty WHERE user_id = ?', (user_id,))
+        row = c.fetchone()
+        dirty = row[0] if row else None
+        c.execute('SELECT signature FROM nav_splits WHERE user_id = ?', (user_id,))
+        row = c.fetchone()
+        stored_signature = row[0] if row else '{}'
+
+        if last_nav is None or start < first_nav or signature != stored_signature:
+            from_date = start
+        else:
+            from_date = min(d for d in (dirty, last_nav) if d)
+        from_date = max(from_date, start)
+        if from_date > start:
+            # Rows dated between two bars count on the later one, so the
+            # window opens the day after the last stored bar before it.
+            c.execute('SELECT MAX(date) FROM nav_history WHERE user_id = ? AND date < ?', (user_id, from_date))
+            prev_bar = c.fetchone()[0]
+            from_date = max(db.from_day(db.to_day(prev_bar) + 1), start) if prev_bar else start
+        from_day = db.to_day(from_date)
+
+        c.execute('''SELECT symbol, date, qty, cost FROM nav_checkpoints k
+                     WHERE user_id = ? AND date = (SELECT MAX(date) FROM nav_checkpoints
+                                                   WHERE user_id = k.user_id AND symbol = k.symbol
+                                                   AND date >= ? AND date < ?)''',
+                  (user_id, start, from_date))
+        initial = {symbol: (pd.Timestamp(date), qty, cost) for symbol, date, qty, cost in c.fetchall()}
+
+        c.execute('''SELECT s.symbol, MAX(t.id) FROM transactions t JOIN symbols s ON s.id = t.symbol_id
+                     WHERE t.user_id = ? AND t.day < ? GROUP BY s.symbol''', (user_id, from_day))
+        last_before = dict(c.fetchall())
+
+        df = _fetch_frame(c, f'{TX_SELECT} WHERE t.user_id = ? AND t.day >= ? ORDER BY t.id', (user_id, from_day))
+
+        # A checkpoint can only be extended when every later row also comes
+        # later in ledger order; otherwise that symbol is replayed from scratch.
+        first_after = df.groupby('symbol')['id'].min()
+        replay = [s for s, i in first_after.items() if s in last_before and i < last_before[s]]
+        if replay:
+            earlier = _fetch_frame(c, f'''{TX_SELECT}
+                                          WHERE t.user_id = ? AND t.day < ? AND s.symbol IN ({",".join("?" * len(replay))})''',
+                                   [user_id, from_day] + replay)
+            df = pd.concat([earlier, df]).sort_values('id')
+            for s in replay:
+                initial.pop(s, None)
+
+        base = db.get_base_currency_db(user_id)
+        c.execute(f'''SELECT {db.DATE_SQL}, {db.CURRENCY_SQL}, TOTAL(t.qty * t.price - t.com) FROM transactions t
+                      WHERE t.user_id = ? AND t.type = ? AND t.day < ? GROUP BY t.day, t.currency''',
+                  (user_id, TxType.SELL, from_day))
+        flows = c.fetchall()
+        c.execute(f'''SELECT {db.DATE_SQL}, {db.CURRENCY_SQL}, -TOTAL(t.amount) FROM withdrawals t
+                      WHERE t.user_id = ? AND t.day < ? GROUP BY t.day, t.currency''', (user_id, from_day))
+        flows += c.fetchall()
+        c.execute(f'''SELECT t.id, 'WITHDRAW', t.amount, t.day, {db.CURRENCY_SQL} FROM withdrawals t
+                      WHERE t.user_id = ? AND t.day >= ? ORDER BY t.id''', (user_id, from_day))
+        df_wd = pd.DataFrame(c.fetchall(), columns=['id', 'type', 'amount', 'day', 'currency'])
+
+        if not df_wd.empty:
+            df = pd.concat([df, df_wd], ignore_index=True)
+        df['date'] = pd.to_datetime(df.pop('day'), unit='D')
+        df = adjust_splits(prepare_frame(df), splits)
+        # The user's benchmarks ride along in the same download, so the chart
+        # reads them from the price store.
+        data = price_matrix(symbols, pd.Timestamp(from_date), db.get_benchmarks_db(user_id))
+        if data.empty: return
+        cash0 = total_in_base(flows, base)
+        df, data = history_in_base(df, data, base, symbols)
+
+        from_ts = pd.Timestamp(from_date)
+        perf.count("nav.rows", len(df))
+        with perf.stage("nav.compute"):
+            qty_states, cost_states = symbol_states(df, initial)
+            index = data.index
+            recent = df[df['date'] >= from_ts]
+            cash = cash_series(recent, index, cash0)
+            nav = portfolio_nav(as_of(qty_states, index), as_of(cost_states, index), cash, data)
+            nav['flow'] = flow_series(recent, index)
+
+        checkpoints = []
+        for symbol, qtys in qty_states.items():
+            costs = cost_states[symbol]
+            for date, q, cost in zip(qtys.index, qtys.values, costs.values):
+                if date >= from_ts or symbol in replay:
+                    checkpoints.append((user_id, symbol, date.strftime("%Y-%m-%d"), float(q), float(cost)))
+
+    rows = [(user_id, d.strftime("%Y-%m-%d"), *r) for d, r in zip(nav.index, nav.itertuples(index=False))]
+    with perf.stage("nav.write"):
+        db.write(_write_nav, user_id, version, from_date, start, rows, replay, checkpoints, signature)
+
+def _write_nav(c, user_id, version, from_date, start, rows, replay, checkpoints, signature):
+    c.execute('DELETE FROM nav_history WHERE user_id = ? AND (date >= ? OR date < ?)', (user_id, from_date, start))
+    c.executemany('INSERT INTO nav_history(user_id, date, stock_value, cash, invested, roi, flow) VALUES (?,?,?,?,?,?,?)', rows)
+    c.execute('DELETE FROM risk_state WHERE user_id = ? AND through_date >= ?', (user_id, from_date))
+    c.execute('DELETE FROM nav_checkpoints WHERE user_id = ? AND (date >= ? OR date < ?)', (user_id, from_date, start))
+    if replay:
+        c.execute(f'DELETE FROM nav_checkpoints WHERE user_id = ? AND symbol IN ({",".join("?" * len(replay))})',
+                  [user_id] + replay)
+    c.executemany('INSERT INTO nav_checkpoints(user_id, symbol, date, qty, cost) VALUES (?,?,?,?,?)', checkpoints)
+    c.execute('INSERT OR REPLACE INTO nav_splits(user_id, signature) VALUES (?,?)', (user_id, signature))
+    # Leave the marker in place if the ledger changed while this ran.
+    c.execute('''DELETE FROM nav_dirty WHERE user_id = ?
+                 AND (SELECT COALESCE(MAX(version), 0) FROM ledger_versions WHERE user_id = ?) = ?''',
+              (user_id, user_id, version))
+
+def _save_risk_state(c, user_id, through_date, state):
+    c.execute('INSERT OR REPLACE INTO risk_state(user_id, through_date, state) VALUES (?,?,?)',
+              (user_id, through_date, state))
+
+def nav_history(user_id, start=None, points=None, benchmarks=None):
+    # start: only read days from this date on; points: downsample to about
+    # this many rows. Returns are still measured from the first day.
+    refresh_nav(user_id)
+    with db.get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT MIN(date) FROM nav_history WHERE user_id = ?', (user_id,))
+        first = c.fetchone()[0]
+        if first is None: return pd.DataFrame()
+        c.execute('SELECT date, roi FROM nav_history WHERE user_id = ? AND date >= ? ORDER BY date',
+                  (user_id, max(start, first) if start else first))
+        rows = c.fetchall()
+    if not rows: return pd.DataFrame()
+
+    df_result = pd.DataFrame(rows, columns=['Date', 'My Portfolio (%)'])
+    df_result['Date'] = pd.to_datetime(df_result['Date'])
+    df_result = df_result.set_index('Date')
+
+    if benchmarks is None:
+        benchmarks = db.get_benchmarks_db(user_id)
+    if benchmarks:
+        try:
+            closes = price_store.get_closes(benchmark_symbols(benchmarks), pd.Timestamp(first))
+        except:
+            closes = pd.DataFrame()
+        add_benchmarks(df_result, closes, benchmarks)
+    if points:
+        df_result = downsample(df_result, points)
+    return df_result
+
+def risk_metrics(user_id):
+    # TWR, volatility, drawdown and Sharpe come from an accumulator stored in
+    # risk_state and extended with the days appended since; refresh_nav drops
+    # it when it recomputes days the accumulator already covers.
+    refresh_nav(user_id)
+    with db.get_conn() as conn:
+        c = conn.cursor()
+        c.execute('SELECT through_date, state FROM risk_state WHERE user_id = ?', (user_id,))
+        row = c.fetchone()
+        acc = RiskAccumulator.from_dict(json.loads(row[1])) if row else RiskAccumulator()
+        c.execute('SELECT date, stock_value + cash, flow FROM nav_history WHERE user_id = ? AND date > ? ORDER BY date',
+                  (user_id, row[0] if row else ''))
+        rows = c.fetchall()
+        if not rows: return {}
+
+        # The last stored day is recomputed on every refresh, so the saved
+        # state stops one day short of it.
+        if len(rows) > 1:
+            acc.extend(*zip(*rows[:-1]))
+            db.write(_save_risk_state, user_id, acc.last_date, json.dumps(acc.to_dict()))
+        acc.extend(*zip(*rows[-1:]))
+
+        c.execute('SELECT date, flow FROM nav_history WHERE user_id = ? AND flow != 0 ORDER BY date', (user_id,))
+        flows = c.fetchall()
+
+    # Investor's view for XIRR: buys are paid in (negative), withdrawals and
+    # the final account value are received (positive).
+    dates = [to_date(d) for d, _ in flows] + [to_date(acc.last_date)]
+    amounts = [-f for _, f in flows] + [acc.last_value]
+    metrics = acc.metrics()
+    metrics["xirr"] = xirr(dates, amounts)
+    return metrics
+
+@st.cache_data(ttl=86400, max_entries=512, show_spinner=False)
+def cached_risk(user_id, ledger_version, price_key):
+    return risk_metrics(user_id)
+
+@st.cache_data(ttl=86400, max_entries=512, show_spinner=False)
+def cached_history(user_id, ledger_version, price_key, start=None, points=CHART_POINTS, benchmarks=None):
+    perf.miss("history_cache")
+    return nav_history(user_id, start, points, list(benchmarks) if benchmarks is not None else None)
@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+
+# Per-render timers and counters. Recording is scoped to the thread running a
+# Streamlit script: start() installs a Recorder, finish() removes it. With no
+# Recorder installed every call below returns straight away.
+#
+# PORTFOLIO_PERF=1 records every render (the sidebar toggle does it per
+# session); PORTFOLIO_PERF_LOG=<path> appends one JSON line per recorded render.
+
+ENABLED_ENV = "PORTFOLIO_PERF"
+LOG_ENV = "PORTFOLIO_PERF_LOG"
+
+ENABLED = os.environ.get(ENABLED_ENV, "") not in ("", "0")
+LOG_PATH = os.environ.get(LOG_ENV)
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+class _Null:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _Null()
+
+
+class _Timer:
+    __slots__ = ('recorder', 'name', 'started')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        entry = self.recorder.stages.setdefault(self.name, [0.0, 0])
+        entry[0] += elapsed
+        entry[1] += 1
+        return False
+
+
+class Recorder:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.total = None
+
+    def hit_rates(self):
+        rates = {}
+        for key, lookups in self.counters.items():
+            if key.endswith(".lookups") and lookups:
+                name = key[:-len(".lookups")]
+                rates[name] = 1.0 - self.counters.get(name + ".misses", 0) / lookups
+        return rates
+
+    def as_dict(self):
+        return {
+            "total": self.total,
+            "stages": {name: {"seconds": round(t, 6), "calls": n} for name, (t, n) in self.stages.items()},
+            "counters": dict(self.counters),
+            "hit_rates": {name: round(r, 4) for name, r in self.hit_rates().items()},
+        }
+
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+def start(enabled=None):
+    if enabled is None:
+        enabled = ENABLED
+    _local.recorder = Recorder() if enabled else None
+    return _local.recorder
+
+def finish(**meta):
+    recorder = current()
+    _local.recorder = None
+    if recorder is None: return None
+
+    recorder.total = time.perf_counter() - recorder.started
+    if LOG_PATH:
+        line = json.dumps({"ts": time.time(), **meta, **recorder.as_dict()}, default=str)
+        with _log_lock, open(LOG_PATH, "a") as f:
+            f.write(line + "\n")
+    return recorder
+
+def stage(name):
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None: return _NULL
+    return _Timer(recorder, name)
+
+def count(name, n=1):
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None: return
+    recorder.counters[name] = recorder.counters.get(name, 0) + n
+
+def lookup(name, n=1, misses=0):
+    # Cache accounting: n lookups of which `misses` had to be computed.
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None: return
+    counters = recorder.counters
+    counters[name + ".lookups"] = counters.get(name + ".lookups", 0) + n
+    counters[name + ".misses"] = counters.get(name + ".misses", 0) + misses
+
+def miss(name):
+    count(name + ".misses")
@@ -0,0 +1,237 @@
+import datetime
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import perf
+from fx import fx_symbol
+from market_data import get_provider
+
+PRICE_DB_NAME = "prices.db"
+
+# How often today's (still moving) bar is re-requested for a symbol.
+REFRESH_SECONDS = 900
+
+# How often a symbol's splits and dividends are re-requested.
+ACTIONS_REFRESH_SECONDS = 86400
+ACTIONS_WORKERS = 8
+
+# FX series are stored as price bars of their fx_symbol and topped up once a
+# day, whichever user asks first.
+FX_REFRESH_SECONDS = 86400
+
+_ready = False
+
+def _connect():
+    global _ready
+    conn = sqlite3.connect(PRICE_DB_NAME, timeout=30)
+    if not _ready:
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS price_bars
+                     (symbol TEXT, date TEXT, close REAL,
+                      PRIMARY KEY(symbol, date)) WITHOUT ROWID''')
+        c.execute('''CREATE TABLE IF NOT EXISTS price_coverage
+                     (symbol TEXT PRIMARY KEY,
+                      first_date TEXT, last_date TEXT, fetched_at REAL)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS corporate_actions
+                     (symbol TEXT, date TEXT, split REAL, dividend REAL,
+                      PRIMARY KEY(symbol, date)) WITHOUT ROWID''')
+        # factor: new shares per share held before `date`, i.e. the product of
+        # this split and every later one. Trades dated before the first split
+        # get its factor, trades after the last split get 1.
+        c.execute('''CREATE TABLE IF NOT EXISTS split_factors
+                     (symbol TEXT, date TEXT, factor REAL,
+                      PRIMARY KEY(symbol, date)) WITHOUT ROWID''')
+        c.execute('''CREATE TABLE IF NOT EXISTS action_coverage
+                     (symbol TEXT PRIMARY KEY, fetched_at REAL)''')
+        conn.commit()
+        _ready = True
+    return conn
+
+def _missing_ranges(c, symbols, start, today, now, refresh=REFRESH_SECONDS):
+    # Groups symbols by the (start, end) window they still need so that a
+    # returning user's whole portfolio is topped up with a single request.
+    c.execute(f'SELECT symbol, first_date, last_date, fetched_at FROM price_coverage WHERE symbol IN ({",".join("?" * len(symbols))})',
+              symbols)
+    coverage = {row[0]: row[1:] for row in c.fetchall()}
+
+    ranges = {}
+    for s in symbols:
+        if s not in coverage:
+            ranges.setdefault((start, None), []).append(s)
+            continue
+        first_date, last_date, fetched_at = coverage[s]
+        if start < first_date:
+            ranges.setdefault((start, first_date), []).append(s)
+        if last_date < today or now - fetched_at > refresh:
+            ranges.setdefault((last_date, None), []).append(s)
+    return ranges
+
+def _fill(c, ranges, today, now):
+    for (start, end), symbols in ranges.items():
+        try:
+            data = get_provider().history(symbols, start, end)
+        except Exception as e:
+            print(f"ERROR fetching prices {symbols} from {start}: {e}")
+            continue
+
+        rows = []
+        for s in symbols:
+            if s not in data.columns: continue
+            col = data[s].dropna()
+            rows.extend((s, d.strftime("%Y-%m-%d"), float(v)) for d, v in col.items())
+        c.executemany('INSERT OR REPLACE INTO price_bars(symbol, date, close) VALUES (?,?,?)', rows)
+
+        for s in symbols:
+            if end is None:
+                c.execute('''INSERT INTO price_coverage(symbol, first_date, last_date, fetched_at) VALUES (?,?,?,?)
+                             ON CONFLICT(symbol) DO UPDATE SET last_date = excluded.last_date, fetched_at = excluded.fetched_at''',
+                          (s, start, today, now))
+            else:
+                c.execute('UPDATE price_coverage SET first_date = ? WHERE symbol = ?', (start, s))
+
+def _fetch_actions(symbol):
+    try:
+        return get_provider().actions(symbol)
+    except Exception as e:
+        print(f"ERROR fetching corporate actions {symbol}: {e}")
+        return None
+
+def _refresh_actions(c, symbols, now):
+    # Providers only serve actions one symbol at a time, so the stale ones are
+    # requested concurrently. Stored closes are adjusted for the splits known
+    # when they were fetched: a symbol whose split factors change loses its
+    # bars and coverage, and its whole history is fetched again.
+    symbols = [s for s in symbols if not s.startswith('^') and not s.endswith('=X')]
+    if not symbols: return
+    c.execute(f'SELECT symbol FROM action_coverage WHERE symbol IN ({",".join("?" * len(symbols))}) AND fetched_at > ?',
+              symbols + [now - ACTIONS_REFRESH_SECONDS])
+    fresh = {r[0] for r in c.fetchall()}
+    stale = [s for s in symbols if s not in fresh]
+    if not stale: return
+    with ThreadPoolExecutor(max_workers=min(ACTIONS_WORKERS, len(stale))) as pool:
+        fetched = list(pool.map(_fetch_actions, stale))
+
+    for s, actions in zip(stale, fetched):
+        if actions is None: continue
+        dates = [d.strftime("%Y-%m-%d") for d in actions.index]
+        c.execute('DELETE FROM corporate_actions WHERE symbol = ?', (s,))
+        c.executemany('INSERT OR REPLACE INTO corporate_actions(symbol, date, split, dividend) VALUES (?,?,?,?)',
+                      [(s, d, float(sp), float(dv)) for d, sp, dv in zip(dates, actions['split'], actions['dividend'])])
+
+        splits = actions['split'].to_numpy(dtype=np.float64)
+        keep = (splits > 0) & (splits != 1)
+        factors = np.cumprod(splits[keep][::-1])[::-1]
+        rows = [(d, float(f)) for d, f in zip(np.array(dates, dtype=object)[keep], factors)]
+        c.execute('SELECT date, factor FROM split_factors WHERE symbol = ? ORDER BY date', (s,))
+        if c.fetchall() != sorted(rows):
+            c.execute('DELETE FROM split_factors WHERE symbol = ?', (s,))
+            c.executemany('INSERT INTO split_factors(symbol, date, factor) VALUES (?,?,?)', [(s, d, f) for d, f in rows])
+            c.execute('DELETE FROM price_bars WHERE symbol = ?', (s,))
+            c.execute('DELETE FROM price_coverage WHERE symbol = ?', (s,))
+        c.execute('INSERT OR REPLACE INTO action_coverage(symbol, fetched_at) VALUES (?,?)', (s, now))
+
+def refresh_actions(symbols):
+    # Brings split factors up to date without reading any bars, for callers
+    # that need the factors before they ask for closes.
+    symbols = [s for s in dict.fromkeys(symbols) if s]
+    if not symbols: return
+    conn = _connect()
+    try:
+        with perf.stage("prices.actions"):
+            _refresh_actions(conn.cursor(), symbols, time.time())
+            conn.commit()
+    finally:
+        conn.close()
+
+def split_factors(symbols):
+    # {symbol: (split days since 1970-01-01, factors)} for the symbols that
+    # have split; never goes to the network. See tx_columns.split_multiplier.
+    symbols = [s for s in dict.fromkeys(symbols) if s]
+    if not symbols: return {}
+    conn = _connect()
+    try:
+        c = conn.cursor()
+        c.execute(f'SELECT symbol, date, factor FROM split_factors WHERE symbol IN ({",".join("?" * len(symbols))}) ORDER BY symbol, date',
+                  symbols)
+        rows = c.fetchall()
+    finally:
+        conn.close()
+
+    grouped = {}
+    for symbol, date, factor in rows:
+        grouped.setdefault(symbol, ([], []))
+        grouped[symbol][0].append(date)
+        grouped[symbol][1].append(factor)
+    return {s: (np.array(d, dtype='datetime64[D]').astype(np.int64), np.array(f, dtype=np.float64))
+            for s, (d, f) in grouped.items()}
+
+def splits_signature(splits):
+    # Stable text form of split_factors(), stored next to results computed with it.
+    return json.dumps({s: [d.tolist(), f.tolist()] for s, (d, f) in splits.items()}, sort_keys=True)
+
+def freshness_key():
+    # Changes whenever get_closes could return newer bars: at the start of each
+    # day and once per REFRESH_SECONDS window for today's bar.
+    return datetime.date.today().isoformat(), int(time.time() // REFRESH_SECONDS)
+
+def last_closes(symbols):
+    # Latest stored close per symbol; never goes to the network.
+    symbols = [s for s in symbols if s]
+    if not symbols: return {}
+    conn = _connect()
+    try:
+        c = conn.cursor()
+        c.execute(f'''SELECT symbol, close FROM price_bars b
+                       WHERE symbol IN ({",".join("?" * len(symbols))})
+                       AND date = (SELECT MAX(date) FROM price_bars WHERE symbol = b.symbol)''', symbols)
+        return dict(c.fetchall())
+    finally:
+        conn.close()
+
+def get_closes(symbols, start, refresh=REFRESH_SECONDS):
+    symbols = list(dict.fromkeys(s for s in symbols if s))
+    if not symbols: return pd.DataFrame()
+    start = pd.Timestamp(start).strftime("%Y-%m-%d")
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    now = time.time()
+
+    conn = _connect()
+    try:
+        c = conn.cursor()
+        # Actions first: a changed split drops the symbol's bars, which are
+        # then fetched again below.
+        with perf.stage("prices.actions"):
+            _refresh_actions(c, symbols, now)
+            conn.commit()
+        ranges = _missing_ranges(c, symbols, start, today, now, refresh)
+        perf.lookup("prices", len(symbols), misses=len({s for group in ranges.values() for s in group}))
+        if ranges:
+            with perf.stage("prices.download"):
+                _fill(c, ranges, today, now)
+                conn.commit()
+
+        c.execute(f'SELECT symbol, date, close FROM price_bars WHERE symbol IN ({",".join("?" * len(symbols))}) AND date >= ?',
+                  symbols + [start])
+        rows = c.fetchall()
+    finally:
+        conn.close()
+
+    if not rows: return pd.DataFrame()
+    df = pd.DataFrame(rows, columns=['symbol', 'Date', 'close'])
+    df['Date'] = pd.to_datetime(df['Date'])
+    data = df.pivot(index='Date', columns='symbol', values='close').sort_index()
+    data.columns.name = None
+    return data.reindex(columns=[s for s in symbols if s in data.columns])
+
+def get_fx_rates(currencies, start):
+    # USD per unit of each currency, one column per currency (USD is 1.0).
+    pairs = {fx_symbol(c): c for c in dict.fromkeys(currencies) if c != "USD"}
+    data = get_closes(list(pairs), start, refresh=FX_REFRESH_SECONDS) if pairs else pd.DataFrame()
+    if data.empty:
+        data = pd.DataFrame(index=pd.DatetimeIndex([pd.Timestamp(start)], name='Date'))
+    data = data.rename(columns=pairs)
+    data["USD"] = 1.0
+    return data.reindex(columns=list(dict.fromkeys(currencies)))
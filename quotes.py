@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import perf
+from market_data import get_provider
+
+MAX_WORKERS = 8
+
+# How often the background refresher re-quotes every held symbol.
+REFRESH_INTERVAL = 60
+
+# Shared by every Streamlit session in the process: quotes are cached per
+# symbol, and a symbol already being fetched is not fetched again.
+_lock = threading.Lock()
+_cache = {}
+_inflight = {}
+_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="quotes")
+
+# Background refresher: one thread per process keeps the union of held
+# symbols (plus anything a page asked for) quoted, so renders never block.
+_watched = set()
+_wake = threading.Event()
+_refresher = None
+_last_refresh = None
+
+def _fetch(symbol):
+    price = None
+    try:
+        price = get_provider().last_price(symbol)
+    except Exception as e:
+        print(f"ERROR fetching quote {symbol}: {e}")
+    with _lock:
+        if price is not None:
+            _cache[symbol] = (price, time.time())
+        _inflight.pop(symbol, None)
+    return price if price is not None else 0.0
+
+def _submit(symbol):
+    # Caller holds _lock.
+    future = _inflight.get(symbol)
+    if future is None:
+        future = _pool.submit(_fetch, symbol)
+        _inflight[symbol] = future
+    return future
+
+def read_prices(symbols, fallback=None):
+    # Non-blocking read of the shared quote table. Symbols never quoted yet are
+    # handed to the refresher and answered from `fallback` (e.g. last close).
+    prices = {}
+    missing = []
+    with _lock:
+        for symbol in dict.fromkeys(symbols):
+            hit = _cache.get(symbol)
+            if hit:
+                prices[symbol] = hit[0]
+            else:
+                missing.append(symbol)
+        if missing:
+            _watched.update(missing)
+            for symbol in missing:
+                _submit(symbol)
+
+    perf.lookup("quotes", len(prices) + len(missing), misses=len(missing))
+    if missing and fallback is not None:
+        try:
+            prices.update(fallback(missing))
+        except Exception as e:
+            print(f"ERROR reading fallback prices {missing}: {e}")
+    return {s: prices.get(s, 0.0) for s in dict.fromkeys(symbols)}
+
+def refresh_now(symbols=None):
+    # Ask the refresher for an immediate pass instead of waiting for the next tick.
+    if symbols:
+        with _lock:
+            _watched.update(symbols)
+    _wake.set()
+
+def last_refresh():
+    return _last_refresh
+
+def _refresh_loop(symbols_fn, interval):
+    global _last_refresh
+    while True:
+        try:
+            symbols = set(symbols_fn())
+        except Exception as e:
+            print(f"ERROR listing held symbols: {e}")
+            symbols = set()
+        with _lock:
+            symbols |= _watched
+            futures = [_submit(s) for s in symbols]
+        wait(futures)
+        _last_refresh = time.time()
+
+        _wake.wait(interval)
+        _wake.clear()
+
+def start_refresher(symbols_fn, interval=REFRESH_INTERVAL):
+    # Idempotent: Streamlit re-executes the app script on every rerun.
+    global _refresher
+    with _lock:
+        if _refresher is not None and _refresher.is_alive():
+            return _refresher
+        _refresher = threading.Thread(target=_refresh_loop, args=(symbols_fn, interval),
+                                      name="quote-refresher", daemon=True)
+        _refresher.start()
+    return _refresher
@@ -0,0 +1,134 @@
+import datetime
+import math
+import numpy as np
+
+# Risk/return statistics over the daily account value (stock value + cash)
+# and its external flows (buys paid in, withdrawals paid out). RiskAccumulator
+# keeps O(1) state so a stored series only has to be extended by the days
+# appended since the last call.
+
+TRADING_DAYS = 252
+SHARPE_WINDOW = 63
+RISK_FREE = 0.0
+
+
+def daily_returns(values, flows, prev_value=None):
+    # Time-weighted daily return: flows land at the end of their day, so
+    # r_t = (V_t - F_t) / V_{t-1} - 1. Days without a prior value count as 0.
+    values = np.asarray(values, dtype=np.float64)
+    flows = np.asarray(flows, dtype=np.float64)
+    prev = np.empty_like(values)
+    if len(values):
+        prev[0] = prev_value if prev_value is not None else 0.0
+        prev[1:] = values[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = (values - flows) / prev - 1.0
+    return np.where(prev > 0, r, 0.0)
+
+
+class RiskAccumulator:
+    __slots__ = ('days', 'mean', 'm2', 'wealth', 'peak', 'max_drawdown', 'last_value', 'last_date', 'window')
+
+    def __init__(self):
+        self.days = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.wealth = 1.0
+        self.peak = 1.0
+        self.max_drawdown = 0.0
+        self.last_value = None
+        self.last_date = None
+        self.window = []
+
+    def extend(self, dates, values, flows):
+        if not len(values): return self
+        r = daily_returns(values, flows, self.last_value)
+
+        # Chan et al. pairwise merge of (count, mean, M2).
+        n_b = len(r)
+        mean_b = r.mean()
+        m2_b = ((r - mean_b) ** 2).sum()
+        n = self.days + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * self.days * n_b / n
+        self.days = n
+
+        wealth = self.wealth * np.cumprod(1.0 + r)
+        peak = np.maximum(np.maximum.accumulate(wealth), self.peak)
+        self.max_drawdown = max(self.max_drawdown, float((1.0 - wealth / peak).max()))
+        self.wealth = float(wealth[-1])
+        self.peak = float(peak[-1])
+
+        self.window = (self.window + r[-SHARPE_WINDOW:].tolist())[-SHARPE_WINDOW:]
+        self.last_value = float(values[-1])
+        self.last_date = dates[-1]
+        return self
+
+    def metrics(self):
+        vol = math.sqrt(self.m2 / (self.days - 1)) * math.sqrt(TRADING_DAYS) if self.days > 1 else 0.0
+        sharpe = None
+        if len(self.window) > 1:
+            w = np.asarray(self.window)
+            std = w.std(ddof=1)
+            if std > 0:
+                sharpe = float((w.mean() - RISK_FREE / TRADING_DAYS) / std * math.sqrt(TRADING_DAYS))
+        return {
+            "twr": self.wealth - 1.0,
+            "volatility": vol,
+            "max_drawdown": self.max_drawdown,
+            "sharpe": sharpe,
+        }
+
+    def to_dict(self):
+        return {f: getattr(self, f) for f in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls()
+        for f in cls.__slots__:
+            setattr(acc, f, state[f])
+        return acc
+
+
+def xirr(dates, amounts, guess=0.1):
+    # Money-weighted return: the annual rate at which the dated cash flows
+    # (investor's view: money in negative, money out positive) have zero NPV.
+    # Newton's method, falling back to bisection when it does not converge.
+    if len(amounts) < 2: return None
+    amounts = np.asarray(amounts, dtype=np.float64)
+    if not (amounts < 0).any() or not (amounts > 0).any(): return None
+    d0 = dates[0]
+    years = np.array([(d - d0).days / 365.0 for d in dates])
+
+    def npv(rate):
+        return (amounts / (1.0 + rate) ** years).sum()
+
+    rate = guess
+    for _ in range(50):
+        if rate <= -1.0: break
+        disc = (1.0 + rate) ** years
+        value = (amounts / disc).sum()
+        deriv = (-years * amounts / (disc * (1.0 + rate))).sum()
+        if deriv == 0: break
+        step = value / deriv
+        rate -= step
+        if abs(step) < 1e-10 and rate > -1.0:
+            return float(rate)
+
+    lo, hi = -0.9999, 10.0
+    f_lo, f_hi = npv(lo), npv(hi)
+    if f_lo * f_hi > 0: return None
+    for _ in range(200):
+        mid = (lo + hi) / 2
+        f_mid = npv(mid)
+        if f_lo * f_mid <= 0:
+            hi = mid
+        else:
+            lo, f_lo = mid, f_mid
+        if hi - lo < 1e-10: break
+    return float((lo + hi) / 2)
+
+
+def to_date(value):
+    return value if isinstance(value, datetime.date) else datetime.date.fromisoformat(str(value)[:10])
@@ -0,0 +1,257 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+import fx
+import price_store
+from benchmarks import benchmark_label, parse_benchmark
+from function import price_matrix, prices_in_base, to_base
+from ledger import TxType
+
+# What-if replays of a user's real ledger. A rule is a dict:
+#   {"substitute": "QQQ"}                      every BUY buys QQQ instead, and
+#   {"substitute": "QQQ", "symbols": ["AAA"]}  every SELL sells the same share
+#                                              of what those buys bought
+#   {"rebalance": "SPY*0.6+AGG*0.4", "every": "M"}
+#                                              every BUY's cash goes into the
+#                                              target weights, rebalanced at
+#                                              each month ("Q", "Y"; None holds)
+# plus an optional "label". All scenarios see the same cash on the same days,
+# fees included, and are valued on one shared price matrix in the base
+# currency. ROI is profit (value + sale proceeds - money paid in) over the
+# money paid in, so the "Actual" column is comparable with every rule;
+# withdrawals come out of proceeds and do not change it.
+#
+# Trades are replayed in date order. Substitutes are evaluated for all rules
+# at once with grouped cumulative sums over (trades x rules) arrays;
+# rebalancing steps through the days with a buy or a rebalance, one
+# (rules x symbols) update per day.
+
+FREQUENCIES = ("M", "Q", "Y", None)
+
+
+def rule_label(rule):
+    if rule.get("label"): return rule["label"]
+    if "substitute" in rule:
+        only = rule.get("symbols")
+        return f"{rule['substitute']} instead" + (f" of {', '.join(only)}" if only else "")
+    spec = rule["rebalance"]
+    name = benchmark_label(spec) if isinstance(spec, str) else "+".join(f"{s}*{w:g}" for s, w in spec.items())
+    return f"{name} ({rule.get('every') or 'hold'})"
+
+def _ticker(symbol):
+    # Same spelling as parse_benchmark and the app's symbol inputs.
+    return symbol.replace(" ", "").upper()
+
+def rule_weights(rule):
+    spec = rule["rebalance"]
+    if isinstance(spec, str): return parse_benchmark(spec)
+    weights = {}
+    for s, w in spec.items():
+        weights[_ticker(s)] = weights.get(_ticker(s), 0.0) + w
+    total = sum(weights.values())
+    if total <= 0 or min(weights.values()) < 0:
+        raise ValueError(f"Bad rebalance weights: {spec!r}")
+    return {s: w / total for s, w in weights.items()}
+
+def normalize_rule(rule):
+    # Copy of `rule` with tickers spelled as they are stored and priced.
+    rule = dict(rule)
+    if "substitute" in rule:
+        rule["substitute"] = _ticker(rule["substitute"])
+        if rule.get("symbols"):
+            rule["symbols"] = [_ticker(s) for s in rule["symbols"]]
+    elif "rebalance" in rule:
+        rule["rebalance"] = rule_weights(rule)
+        if rule.get("every") not in FREQUENCIES:
+            raise ValueError(f"Bad rebalance frequency: {rule.get('every')!r}")
+    else:
+        raise ValueError(f"Unknown scenario rule: {rule!r}")
+    return rule
+
+def rule_symbols(rule):
+    return [rule["substitute"]] if "substitute" in rule else list(rule_weights(rule))
+
+def _group_cumsum(values, keys):
+    # Running sum of `values` (rows x ...) within each key, in row order.
+    order = np.argsort(keys, kind='stable')
+    v = values[order]
+    run = np.cumsum(v, axis=0)
+    k = keys[order]
+    start = np.r_[True, k[1:] != k[:-1]]
+    first = np.maximum.accumulate(np.where(start, np.arange(len(k)), 0))
+    out = np.empty_like(run)
+    out[order] = run - (run - v)[first]
+    return out
+
+def _group_diff(values, keys):
+    # Each row minus the previous row with the same key (0 before the first).
+    order = np.argsort(keys, kind='stable')
+    v = values[order]
+    k = keys[order]
+    prev = np.zeros_like(v)
+    prev[1:] = v[:-1]
+    prev[np.r_[True, k[1:] != k[:-1]]] = 0.0
+    out = np.empty_like(v)
+    out[order] = v - prev
+    return out
+
+def _at_bars(bars, n_bars, values):
+    # Per-row amounts summed into their bar and accumulated over the bars.
+    out = np.zeros((n_bars,) + values.shape[1:])
+    np.add.at(out, bars, values)
+    return np.cumsum(out, axis=0)
+
+def _trades(cols, index):
+    # Scenario-independent arrays for the BUY/SELL rows in date order: bar
+    # (first bar on or after the trade), symbol code, cash paid in or received,
+    # and each sale's share of the position it sells from.
+    trade = ((cols.types == TxType.BUY) | (cols.types == TxType.SELL)) & (cols.codes >= 0)
+    order = np.lexsort((cols.ids[trade], cols.days[trade]))
+    rows = np.flatnonzero(trade)[order]
+    bars = np.searchsorted(index.to_numpy(dtype='datetime64[D]').astype(np.int64), cols.days[rows], side='left')
+    rows, bars = rows[bars < len(index)], bars[bars < len(index)]
+
+    buy = cols.types[rows] == TxType.BUY
+    code = cols.codes[rows].astype(np.int64)
+    qty, price, com = cols.qty[rows], cols.price[rows], cols.com[rows]
+
+    # Sells before a symbol's first buy are ignored, as in the ledger.
+    bought = _group_cumsum(buy.astype(np.float64), code) > 0
+    signed = np.where(buy, qty, np.where(bought, -qty, 0.0))
+    held_after = _group_cumsum(signed, code)
+    held_before = held_after - signed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where(~buy & (held_before > 0), np.clip(qty / held_before, 0.0, 1.0), 0.0)
+    return {
+        "bars": bars, "code": code, "buy": buy, "signed": signed,
+        "cost": np.where(buy, qty * price, 0.0), "com": com, "frac": frac,
+        "paid": np.where(buy, qty * price + com, 0.0),
+        "received": np.where(buy, 0.0, qty * price - com),
+    }
+
+def _actual(tr, held_prices):
+    # Per-symbol value and cumulative proceeds of the real ledger (bars x symbols).
+    n_bars, n_symbols = held_prices.shape
+    qty = np.zeros((n_bars, n_symbols))
+    np.add.at(qty, (tr["bars"], tr["code"]), tr["signed"])
+    proceeds = np.zeros((n_bars, n_symbols))
+    np.add.at(proceeds, (tr["bars"], tr["code"]), tr["received"])
+    return np.maximum(np.cumsum(qty, axis=0), 0.0) * held_prices, np.cumsum(proceeds, axis=0)
+
+def _substitute(tr, targets, mask):
+    # targets: (bars x rules) prices of each rule's substitute; mask: (rules x
+    # symbols), 1 where a symbol's trades are substituted. Each buy adds a lot
+    # of cost / target price; sells scale the symbol's lots by (1 - frac)
+    # through a per-symbol running product, restarted after a full sale.
+    bars, code, frac = tr["bars"], tr["code"], tr["frac"]
+    full = frac >= 1.0
+    epoch = _group_cumsum(full.astype(np.int64), code) - full
+    survive = np.exp(_group_cumsum(np.log(np.where(full, 1.0, 1.0 - frac)), code))
+    weight = mask[:, code].T
+    lots_in = (tr["cost"][:, None] / targets[bars]) * weight
+    key = code * (len(code) + 1) + epoch
+    lots = np.where(full[:, None], 0.0, survive[:, None] * _group_cumsum(lots_in / survive[:, None], key))
+    delta = _group_diff(lots, code)
+
+    sold = np.where(tr["buy"][:, None], 0.0, -delta)
+    received = (sold * targets[bars] - np.where(tr["buy"], 0.0, tr["com"])[:, None]) * weight
+    units = _at_bars(bars, len(targets), delta)
+    return units * targets, _at_bars(bars, len(targets), received)
+
+def _rebalance(paid, prices, weights, starts):
+    # paid: (bars,) money in per bar; prices: (bars x symbols); weights:
+    # (rules x symbols); starts: bars where the rules rebalance.
+    units = np.zeros(weights.shape)
+    events = np.flatnonzero((paid > 0) | starts)
+    history = np.zeros((len(events),) + weights.shape)
+    for i, bar in enumerate(events):
+        if starts[bar]:
+            total = units @ prices[bar] + paid[bar]
+            units = total[:, None] * weights / prices[bar]
+        else:
+            units = units + paid[bar] * weights / prices[bar]
+        history[i] = units
+    last = np.searchsorted(events, np.arange(len(prices)), side='right') - 1
+    values = np.zeros((len(prices), len(weights)))
+    held = last >= 0
+    for j in range(prices.shape[1]):
+        values[held] += history[last[held], :, j] * prices[held, j][:, None]
+    return values
+
+def _rebalance_starts(index, every):
+    if every is None: return np.zeros(len(index), dtype=bool)
+    periods = index.to_period(every).asi8
+    return np.r_[True, periods[1:] != periods[:-1]]
+
+def _evaluate(inputs, rules):
+    # One batch of rules over the shared inputs; returns (bars x rules) ROI.
+    index, prices, columns, tr, symbols = (inputs[k] for k in ("index", "prices", "columns", "trades", "symbols"))
+    at = {s: i for i, s in enumerate(columns)}
+    value, received = inputs["actual"]
+    paid = _at_bars(tr["bars"], len(index), tr["paid"])
+    wealth = np.zeros((len(index), len(rules)))
+
+    subs = [i for i, r in enumerate(rules) if "substitute" in r]
+    if subs:
+        mask = np.array([[1.0 if not rules[i].get("symbols") or s in rules[i]["symbols"] else 0.0 for s in symbols]
+                         for i in subs]).reshape(len(subs), len(symbols))
+        targets = prices[:, [at[rules[i]["substitute"]] for i in subs]]
+        sub_value, sub_received = _substitute(tr, targets, mask)
+        kept = (value + received) @ (1.0 - mask).T
+        wealth[:, subs] = sub_value + sub_received + kept
+
+    daily_paid = np.diff(paid, prepend=0.0)
+    for every in FREQUENCIES:
+        group = [i for i, r in enumerate(rules) if "rebalance" in r and r.get("every") == every]
+        if not group: continue
+        names = list(dict.fromkeys(s for i in group for s in rule_weights(rules[i])))
+        weights = np.array([[rule_weights(rules[i]).get(s, 0.0) for s in names] for i in group])
+        wealth[:, group] = _rebalance(daily_paid, prices[:, [at[s] for s in names]], weights,
+                                      _rebalance_starts(index, every))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(paid[:, None] > 0, (wealth - paid[:, None]) / paid[:, None] * 100, 0.0)
+
+def simulate(transactions, rules, base=fx.BASE_CURRENCY, processes=None):
+    # transactions: get_tx_db rows, a Ledger or TxColumns. Returns a frame of
+    # ROI (%) per day, "Actual" first and then one column per rule; with
+    # `processes`, the rules are split across a process pool.
+    normalized = [normalize_rule(r) for r in rules]
+    labels = [rule_label(r) for r in rules]
+    rules = normalized
+    cols = to_base(transactions, base)
+    if not len(cols): return pd.DataFrame()
+    cols = cols.adjusted(price_store.split_factors(cols.symbols))
+
+    extra = list(dict.fromkeys(s for rule in rules for s in rule_symbols(rule)))
+    data = price_matrix(cols.symbols, pd.Timestamp(cols.dates().min()), extra)
+    if data.empty: return pd.DataFrame()
+    missing = [s for s in extra if s not in data.columns or data[s].isna().all()]
+    if missing:
+        raise ValueError(f"No prices for scenario symbols: {', '.join(missing)}")
+    columns = list(dict.fromkeys(cols.symbols + extra))
+    data = prices_in_base(data.reindex(columns=columns), base, columns).ffill().bfill()
+
+    tr = _trades(cols, data.index)
+    held = data[cols.symbols].fillna(0.0).to_numpy()
+    inputs = {
+        "index": data.index, "prices": data.to_numpy(), "columns": columns, "trades": tr,
+        "symbols": cols.symbols, "actual": _actual(tr, held),
+    }
+    value, received = inputs["actual"]
+    paid = _at_bars(tr["bars"], len(data.index), tr["paid"])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        actual = np.where(paid > 0, (value.sum(axis=1) + received.sum(axis=1) - paid) / paid * 100, 0.0)
+
+    if processes and processes > 1 and len(rules) > 1:
+        chunks = [list(c) for c in np.array_split(np.arange(len(rules)), min(processes, len(rules)))]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            parts = list(pool.map(_evaluate, [inputs] * len(chunks), [[rules[i] for i in c] for c in chunks]))
+        roi = np.hstack(parts)
+    else:
+        roi = _evaluate(inputs, rules) if rules else np.zeros((len(data.index), 0))
+
+    df = pd.DataFrame(roi, index=data.index, columns=labels)
+    df.insert(0, "Actual", actual)
+    df.index.name = 'Date'
+    return df
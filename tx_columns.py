@@ -0,0 +1,171 @@
+import numpy as np
+from fx import CURRENCIES, CURRENCY_NAMES, currency_code, symbol_currency
+from ledger import TxType, TYPE_CODES, TYPE_NAMES  # noqa: F401
+
+CHUNK_SIZE = 20000
+
+
+def split_multiplier(days, split_days, factors):
+    # Per-row share multiplier for trades on `days`, given a symbol's split
+    # dates and cumulative factors (price_store.split_factors). A trade on
+    # the ex-date is already in post-split shares.
+    return np.append(factors, 1.0)[np.searchsorted(split_days, days, side='right')]
+
+
+class TxColumns:
+    # Column-oriented ledger: one NumPy array per field, symbols interned to
+    # integer codes (-1 for none), dates as int64 days since 1970-01-01 and
+    # currencies as ISO 4217 numeric codes.
+    __slots__ = ('ids', 'types', 'codes', 'symbols', 'qty', 'price', 'com', 'amount', 'days', 'currency')
+
+    def __init__(self, ids, types, codes, symbols, qty, price, com, days, amount=None, currency=None):
+        self.ids = ids
+        self.types = types
+        self.codes = codes
+        self.symbols = symbols
+        self.qty = qty
+        self.price = price
+        self.com = com
+        self.days = days
+        self.amount = amount if amount is not None else np.zeros(len(ids))
+        self.currency = currency if currency is not None else np.full(len(ids), CURRENCIES["USD"], np.int16)
+
+    @classmethod
+    def from_rows(cls, rows, chunk_size=CHUNK_SIZE):
+        # rows: a cursor or iterable of (id, type, symbol, qty, price, com, date,
+        # currency) tuples; a missing currency is the symbol's quote currency.
+        # Cursors are drained in chunks so peak memory stays bounded by one
+        # chunk of row tuples rather than the whole result set.
+        if hasattr(rows, 'fetchmany'):
+            chunks = iter(lambda: rows.fetchmany(chunk_size), [])
+        else:
+            rows = list(rows)
+            chunks = iter([rows] if rows else [])
+
+        interned = {}
+        parts = []
+        for chunk in chunks:
+            ids, types, symbols, qty, price, com, dates, currencies = zip(*chunk)
+            parts.append((
+                np.array(ids, dtype=np.int64),
+                np.fromiter((TYPE_CODES.get(t, -1) for t in types), dtype=np.int8, count=len(chunk)),
+                np.fromiter((-1 if not s else interned.setdefault(s, len(interned)) for s in symbols),
+                            dtype=np.int32, count=len(chunk)),
+                np.array(qty, dtype=np.float64),
+                np.array(price, dtype=np.float64),
+                np.array(com, dtype=np.float64),
+                np.array(dates, dtype='datetime64[D]').astype(np.int64),
+                np.fromiter((currency_code(c or symbol_currency(s)) for s, c in zip(symbols, currencies)),
+                            dtype=np.int16, count=len(chunk)),
+            ))
+        if not parts:
+            return cls.empty()
+
+        ids, types, codes, qty, price, com, days, currency = (np.concatenate(p) for p in zip(*parts))
+        return cls(ids=ids, types=types, codes=codes, symbols=list(interned),
+                   qty=qty, price=price, com=com, days=days, currency=currency)
+
+    @classmethod
+    def from_coded(cls, rows, symbol_names, chunk_size=CHUNK_SIZE):
+        # rows: (id, type code, symbol id or -1, qty, price, com, epoch day,
+        # currency code) tuples as stored in the transactions table, so
+        # nothing is parsed.
+        # symbol_names maps symbol id -> ticker.
+        if hasattr(rows, 'fetchmany'):
+            chunks = iter(lambda: rows.fetchmany(chunk_size), [])
+        else:
+            rows = list(rows)
+            chunks = iter([rows] if rows else [])
+        parts = [np.array(chunk, dtype=np.float64) for chunk in chunks]
+        if not parts:
+            return cls.empty()
+
+        block = np.concatenate(parts)
+        uniq, codes = np.unique(block[:, 2].astype(np.int64), return_inverse=True)
+        if uniq[0] < 0:
+            codes -= 1
+            uniq = uniq[1:]
+        return cls(ids=block[:, 0].astype(np.int64), types=block[:, 1].astype(np.int8),
+                   codes=codes.astype(np.int32), symbols=[symbol_names[i] for i in uniq.tolist()],
+                   qty=block[:, 3].copy(), price=block[:, 4].copy(), com=block[:, 5].copy(),
+                   days=block[:, 6].astype(np.int64), currency=block[:, 7].astype(np.int16))
+
+    @classmethod
+    def from_records(cls, transactions):
+        return cls.from_rows((t.get('id'), t.get('type'), t.get('symbol'), t.get('qty'), t.get('price'),
+                              t.get('com'), t.get('date'), t.get('currency')) for t in transactions)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0, np.int64), np.zeros(0, np.int8), np.zeros(0, np.int32), [],
+                   np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0, np.int64), currency=np.zeros(0, np.int16))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        # Row view for callers that still expect dicts; nothing is materialized up front.
+        dates = np.datetime_as_string(self.dates())
+        for i in range(len(self.ids)):
+            code = self.codes[i]
+            yield {
+                'id': int(self.ids[i]),
+                'type': TYPE_NAMES[self.types[i]] if self.types[i] >= 0 else None,
+                'symbol': self.symbols[code] if code >= 0 else None,
+                'qty': float(self.qty[i]),
+                'price': float(self.price[i]),
+                'com': float(self.com[i]),
+                'date': str(dates[i]),
+                'currency': CURRENCY_NAMES.get(int(self.currency[i])),
+            }
+
+    def dates(self):
+        return self.days.astype('datetime64[D]')
+
+    def symbol_array(self):
+        lookup = np.array(self.symbols + [None], dtype=object)
+        return lookup[self.codes]
+
+    def type_array(self):
+        lookup = np.array(TYPE_NAMES + [None], dtype=object)
+        return lookup[self.types]
+
+    def currency_array(self):
+        codes, inverse = np.unique(self.currency, return_inverse=True)
+        return np.array([CURRENCY_NAMES.get(int(c)) for c in codes], dtype=object)[inverse.reshape(-1)]
+
+    def nbytes(self):
+        return sum(getattr(self, f).nbytes
+                   for f in ('ids', 'types', 'codes', 'qty', 'price', 'com', 'amount', 'days', 'currency'))
+
+    def adjusted(self, splits):
+        # Copy with quantities in today's shares and prices per today's share;
+        # qty * price, and so every cash amount, is unchanged.
+        if not splits: return self
+        factor = np.ones(len(self.ids))
+        for code, symbol in enumerate(self.symbols):
+            if symbol in splits:
+                rows = self.codes == code
+                factor[rows] = split_multiplier(self.days[rows], *splits[symbol])
+        return TxColumns(self.ids, self.types, self.codes, self.symbols, self.qty * factor, self.price / factor,
+                         self.com, self.days, self.amount, self.currency)
+
+    def converted(self, rates, currency):
+        # Copy with every amount multiplied by its row's rate into `currency`.
+        return TxColumns(self.ids, self.types, self.codes, self.symbols, self.qty, self.price * rates,
+                         self.com * rates, self.days, self.amount * rates,
+                         np.full(len(self.ids), currency_code(currency), np.int16))
+
+    def to_frame(self, parse_dates=False):
+        import pandas as pd
+        dates = self.dates()
+        return pd.DataFrame({
+            'id': self.ids,
+            'type': self.type_array(),
+            'symbol': self.symbol_array(),
+            'qty': self.qty,
+            'price': self.price,
+            'com': self.com,
+            'date': dates.astype('datetime64[ns]') if parse_dates else np.datetime_as_string(dates),
+            'currency': self.currency_array(),
+        })
@@ -0,0 +1,96 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import database as db
+import price_store
+
+# Usage: python worker.py [--processes N] [--users 1 2 3] [--db portfolio.db]
+# Precomputes every user's NAV history and ledger summary so the app only
+# reads stored results. Meant to run from cron (e.g. after the market close);
+# the app still computes anything that went stale since the last run.
+
+
+def _init(db_name, price_db_name):
+    db.DB_NAME = db_name
+    price_store.PRICE_DB_NAME = price_db_name
+
+
+def precompute_user(user_id):
+    from function import summary_in_base
+    from nav import refresh_nav
+
+    started = time.perf_counter()
+    # Read the version first: if the ledger changes mid-run the saved summary
+    # is simply treated as stale.
+    version = db.get_ledger_version_db(user_id)
+    refresh_nav(user_id)
+    splits = price_store.split_factors(db.get_tx_symbols_db(user_id))
+    summary = summary_in_base(db.get_tx_columns(user_id), db.get_base_currency_db(user_id), splits)
+    db.save_summary_db(user_id, version, *summary, splits_key=price_store.splits_signature(splits))
+    return user_id, time.perf_counter() - started
+
+
+def warm_prices():
+    # One download pass for the union of every user's symbols, benchmarks and
+    # currencies, so the workers only ever read bars that are already in the
+    # shared price store.
+    from benchmarks import benchmark_symbols
+    from fx import symbol_currency
+    symbols, start = db.get_all_symbols_db()
+    if start is None: return 0
+    price_store.get_closes(sorted(set(symbols) | set(benchmark_symbols(db.get_all_benchmarks_db()))), start)
+    price_store.get_fx_rates(sorted(set(db.get_all_currencies_db()) | {symbol_currency(s) for s in symbols}), start)
+    return len(symbols)
+
+
+def run(user_ids=None, processes=None):
+    db.init_db()
+    if user_ids is None:
+        user_ids = db.get_user_ids_db()
+
+    started = time.perf_counter()
+    n_symbols = warm_prices()
+    fetched = time.perf_counter() - started
+    print(f"prices: {n_symbols} symbols in {fetched:.2f}s", file=sys.stderr)
+
+    failed = []
+    done = 0
+    # Spawned, not forked: a forked child would inherit the parent's pooled
+    # SQLite connections and writer thread, which SQLite does not allow.
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init,
+                             initargs=(db.DB_NAME, price_store.PRICE_DB_NAME),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(precompute_user, uid): uid for uid in user_ids}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                done += 1
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"user {futures[future]}: {e}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    print(f"users: {done} done, {len(failed)} failed in {elapsed:.2f}s "
+          f"({done / elapsed if elapsed else 0:.1f} users/s)", file=sys.stderr)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute NAV history and summaries for all users.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--users", type=int, nargs="+", help="only these user ids")
+    parser.add_argument("--db", default=db.DB_NAME)
+    parser.add_argument("--price-db", default=price_store.PRICE_DB_NAME)
+    args = parser.parse_args(argv)
+
+    _init(args.db, args.price_db)
+    failed = run(args.users, args.processes)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()